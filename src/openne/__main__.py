@@ -1,4 +1,5 @@
 from __future__ import print_function
+import os
 import numpy as np
 import random
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
@@ -14,6 +15,7 @@ from . import hope
 from . import lap
 from . import gf
 from . import sdne
+from .embeddings import save_binary_embeddings
 from .grarep import GraRep
 import time
 import ast
@@ -23,25 +25,49 @@ def parse_args():
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter,
                             conflict_handler='resolve')
     parser.add_argument('--input', required=True,
-                        help='Input graph file')
+                        help='Input graph file, may be compressed (.gz, .bz2, .xz, .zst) or a quoted glob pattern of shards')
     parser.add_argument('--output',
                         help='Output representation file')
+    parser.add_argument('--output-format', default='text', choices=['text', 'binary'],
+                        help='Write text, or a float32 .npy matrix with the node ids in <output>.ids')
+    parser.add_argument('--output-precision', default=None, type=int,
+                        help='Significant digits of text output, by default enough to read back exact values')
     parser.add_argument('--number-walks', default=10, type=int,
                         help='Number of random walks to start at each node')
     parser.add_argument('--directed', action='store_true',
                         help='Treat graph as directed.')
     parser.add_argument('--walk-length', default=80, type=int,
                         help='Length of the random walk started at each node')
+    parser.add_argument('--walk-corpus', default='memory',
+                        choices=['memory', 'stream', 'file', 'pipeline'],
+                        help='Keep all walks in memory, regenerate them on every Word2Vec pass, '
+                             'write them to a temporary corpus file, '
+                             'or train on them while --workers processes walk')
+    parser.add_argument('--walk-cache', default=None,
+                        help='Directory to keep the walks of node2vec and deepWalk in, '
+                             'reused by runs on the same graph with the same walk settings and seed')
     parser.add_argument('--workers', default=8, type=int,
                         help='Number of parallel processes.')
+    parser.add_argument('--seed', default=32, type=int,
+                        help='Random seed, walks are reproducible for a given seed and number of workers')
     parser.add_argument('--representation-size', default=128, type=int,
                         help='Number of latent dimensions to learn for each node.')
     parser.add_argument('--window-size', default=10, type=int,
                         help='Window size of skipgram model.')
+    parser.add_argument('--negative', default=5, type=int,
+                        help='Number of negative samples of skipgram model.')
+    parser.add_argument('--trainer', default='gensim', choices=['gensim', 'skipgram'],
+                        help='Train node2vec and deepWalk with gensim Word2Vec, '
+                             'or the built-in multi-process skipgram trainer, '
+                             'which trains deepWalk with negative sampling instead of '
+                             'hierarchical softmax')
     parser.add_argument('--epochs', default=5, type=int,
                         help='The training epochs of LINE and GCN')
     parser.add_argument('--p', default=1.0, type=float)
     parser.add_argument('--q', default=1.0, type=float)
+    parser.add_argument('--walk-mode', default='alias', choices=['alias', 'rejection'],
+                        help='node2vec sampling: alias tables for every edge, '
+                             'or rejection sampling with tables for nodes only')
     parser.add_argument('--method', required=True, choices=[
         'node2vec',
         'deepWalk',
@@ -59,16 +85,29 @@ def parse_args():
                         help='The file of node label')
     parser.add_argument('--feature-file', default='',
                         help='The file of node features')
+    parser.add_argument('--sparse-features', action='store_true',
+                        help='Stream the feature file into a sparse matrix')
     parser.add_argument('--graph-format', default='adjlist', choices=['adjlist', 'edgelist'],
                         help='Input graph format')
     parser.add_argument('--negative-ratio', default=5, type=int,
                         help='the negative ratio of LINE')
     parser.add_argument('--weighted', action='store_true',
                         help='Treat graph as weighted')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='Parse the input with the vectorized bulk loader into compact CSR arrays')
+    parser.add_argument('--node-ids', default='auto', choices=['auto', 'int', 'str'],
+                        help='Keep node ids as integers or strings with --bulk-load, auto detects integer ids')
+    parser.add_argument('--graph-cache', default='',
+                        help='Directory caching the parsed graph between runs')
+    parser.add_argument('--mmap', action='store_true',
+                        help='Memory-map the cached graph arrays instead of loading them (needs --graph-cache)')
     parser.add_argument('--clf-ratio', default=0.5, type=float,
                         help='The ratio of training data in the classification')
     parser.add_argument('--order', default=3, type=int,
                         help='Choose the order of LINE, 1 means first order, 2 means second order, 3 means first order + second order')
+    parser.add_argument('--line-concurrent', action='store_true',
+                        help='Train the first- and second-order LINE models of order 3 concurrently, '
+                             'sharing --workers threads')
     parser.add_argument('--no-auto-save', action='store_true',
                         help='no save the best embeddings when training LINE')
     parser.add_argument('--dropout', default=0.5, type=float,
@@ -102,6 +141,15 @@ def parse_args():
         print("No output filename. Exit.")
         exit(1)
 
+    if not args.bulk_load and (len(input_files(args.input)) > 1 or
+                               is_compressed(args.input)):
+        print("Compressed or sharded input, using the bulk loader.")
+        args.bulk_load = True
+
+    if args.mmap and not args.graph_cache:
+        print("--mmap needs --graph-cache. Exit.")
+        exit(1)
+
     return args
 
 
@@ -110,38 +158,76 @@ def main(args):
     g = Graph()
     print("Reading...")
 
-    if args.graph_format == 'adjlist':
+    cache = ''
+    if args.graph_cache:
+        cache = cache_path(args.graph_cache, args.input,
+                           graph_format=args.graph_format,
+                           weighted=args.weighted, directed=args.directed,
+                           bulk_load=args.bulk_load, node_ids=args.node_ids)
+    mmap_mode = 'r' if args.mmap else None
+    if cache and os.path.isdir(cache):
+        g.load_cache(cache, mmap_mode=mmap_mode)
+    elif args.bulk_load:
+        int_ids = {'auto': None, 'int': True, 'str': False}[args.node_ids]
+        if args.graph_format == 'adjlist':
+            g.load_adjlist(filename=args.input, int_ids=int_ids,
+                           workers=args.workers)
+        elif args.graph_format == 'edgelist':
+            g.load_edgelist(filename=args.input, weighted=args.weighted,
+                            directed=args.directed, int_ids=int_ids,
+                            workers=args.workers)
+    elif args.graph_format == 'adjlist':
         g.read_adjlist(filename=args.input)
     elif args.graph_format == 'edgelist':
         g.read_edgelist(filename=args.input, weighted=args.weighted,
                         directed=args.directed)
+    if cache and not os.path.isdir(cache):
+        if not os.path.isdir(args.graph_cache):
+            os.makedirs(args.graph_cache)
+        g.save_cache(cache)
+        if args.mmap:
+            g.load_cache(cache, mmap_mode=mmap_mode)
     if args.method == 'node2vec':
         model = node2vec.Node2vec(graph=g, path_length=args.walk_length,
                                   num_paths=args.number_walks, dim=args.representation_size,
-                                  workers=args.workers, p=args.p, q=args.q, window=args.window_size)
+                                  workers=args.workers, p=args.p, q=args.q, window=args.window_size,
+                                  seed=args.seed, walk_corpus=args.walk_corpus,
+                                  walk_mode=args.walk_mode, walk_cache=args.walk_cache,
+                                  trainer=args.trainer, negative=args.negative)
     elif args.method == 'line':
         if args.label_file and not args.no_auto_save:
             model = line.LINE(g, epoch=args.epochs, rep_size=args.representation_size, order=args.order,
-                              label_file=args.label_file, clf_ratio=args.clf_ratio)
+                              label_file=args.label_file, clf_ratio=args.clf_ratio,
+                              concurrent=args.line_concurrent, workers=args.workers)
         else:
             model = line.LINE(g, epoch=args.epochs,
-                              rep_size=args.representation_size, order=args.order)
+                              rep_size=args.representation_size, order=args.order,
+                              concurrent=args.line_concurrent, workers=args.workers)
     elif args.method == 'deepWalk':
         model = node2vec.Node2vec(graph=g, path_length=args.walk_length,
                                   num_paths=args.number_walks, dim=args.representation_size,
-                                  workers=args.workers, window=args.window_size, dw=True)
+                                  workers=args.workers, window=args.window_size, dw=True,
+                                  seed=args.seed, walk_corpus=args.walk_corpus,
+                                  walk_cache=args.walk_cache, trainer=args.trainer,
+                                  negative=args.negative)
     elif args.method == 'tadw':
         # assert args.label_file != ''
         assert args.feature_file != ''
         g.read_node_label(args.label_file)
-        g.read_node_features(args.feature_file)
+        if args.sparse_features:
+            g.read_node_features_sparse(args.feature_file)
+        else:
+            g.read_node_features(args.feature_file)
         model = tadw.TADW(
             graph=g, dim=args.representation_size, lamb=args.lamb)
     elif args.method == 'gcn':
         assert args.label_file != ''
         assert args.feature_file != ''
         g.read_node_label(args.label_file)
-        g.read_node_features(args.feature_file)
+        if args.sparse_features:
+            g.read_node_features_sparse(args.feature_file)
+        else:
+            g.read_node_features(args.feature_file)
         model = gcnAPI.GCN(graph=g, dropout=args.dropout,
                            weight_decay=args.weight_decay, hidden1=args.hidden,
                            epochs=args.epochs, clf_ratio=args.clf_ratio)
@@ -165,10 +251,14 @@ def main(args):
     print(t2-t1)
     if args.method != 'gcn':
         print("Saving embeddings...")
-        model.save_embeddings(args.output)
+        if args.output_format == 'binary':
+            save_binary_embeddings(args.output, model.vectors)
+        else:
+            model.save_embeddings(args.output, precision=args.output_precision,
+                                  workers=args.workers)
     if args.label_file and args.method != 'gcn':
         vectors = model.vectors
-        X, Y = read_node_label(args.label_file)
+        X, Y = read_node_label(args.label_file, g.int_ids)
         print("Training classifier using {:.2f}% nodes...".format(
             args.clf_ratio*100))
         clf = Classifier(vectors=vectors, clf=LogisticRegression())
@@ -176,6 +266,7 @@ def main(args):
 
 
 if __name__ == "__main__":
-    random.seed(32)
-    np.random.seed(32)
-    main(parse_args())
+    args = parse_args()
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    main(args)
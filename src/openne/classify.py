@@ -4,6 +4,7 @@ from sklearn.multiclass import OneVsRestClassifier
 from sklearn.metrics import f1_score
 from sklearn.preprocessing import MultiLabelBinarizer
 from time import time
+from .embeddings import EmbeddingView
 
 
 class TopKRanker(OneVsRestClassifier):
@@ -28,7 +29,7 @@ class Classifier(object):
 
     def train(self, X, Y, Y_all):
         self.binarizer.fit(Y_all)
-        X_train = [self.embeddings[x] for x in X]
+        X_train = self.get_vectors(X)
         Y = self.binarizer.transform(Y)
         self.clf.fit(X_train, Y)
 
@@ -47,10 +48,15 @@ class Classifier(object):
         # print('-------------------')
 
     def predict(self, X, top_k_list):
-        X_ = numpy.asarray([self.embeddings[x] for x in X])
+        X_ = self.get_vectors(X)
         Y = self.clf.predict(X_, top_k_list=top_k_list)
         return Y
 
+    def get_vectors(self, X):
+        if isinstance(self.embeddings, EmbeddingView):
+            return self.embeddings.take(X)
+        return numpy.asarray([self.embeddings[x] for x in X])
+
     def split_train_evaluate(self, X, Y, train_precent, seed=None):
         state = numpy.random.get_state()
 
@@ -83,7 +89,20 @@ def load_embeddings(filename):
     return vectors
 
 
-def read_node_label(filename):
+def load_binary_embeddings(filename):
+    '''
+    Memory-map embeddings written by embeddings.save_binary_embeddings.
+    Returns the (node_num, size) float32 matrix and a dict from node id to row.
+    '''
+    matrix = numpy.load(filename, mmap_mode='r')
+    fin = open(filename + '.ids', 'r')
+    rows = dict((node, i) for i, node in enumerate(fin.read().split()))
+    fin.close()
+    assert len(rows) == matrix.shape[0]
+    return matrix, rows
+
+
+def read_node_label(filename, int_ids=False):
     fin = open(filename, 'r')
     X = []
     Y = []
@@ -92,7 +111,7 @@ def read_node_label(filename):
         if l == '':
             break
         vec = l.strip().split(' ')
-        X.append(vec[0])
+        X.append(int(vec[0]) if int_ids else vec[0])
         Y.append(vec[1:])
     fin.close()
     return X, Y
@@ -0,0 +1,122 @@
+from __future__ import print_function
+import gzip
+import multiprocessing
+import numpy as np
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class EmbeddingView(Mapping):
+    '''
+    Read-only mapping from node to its row of one (node_size, dim) matrix,
+    whose rows follow the graph's look_back_list.
+    '''
+
+    def __init__(self, graph, matrix):
+        self.graph = graph
+        self.matrix = matrix
+
+    def __getitem__(self, node):
+        return self.matrix[self.graph.look_up_dict[node]]
+
+    def __iter__(self):
+        return iter(self.nodes())
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def __contains__(self, node):
+        return node in self.graph.look_up_dict
+
+    def nodes(self):
+        look_back = self.graph.look_back_list
+        if isinstance(look_back, np.ndarray):
+            return look_back.tolist()
+        return list(look_back)
+
+    def take(self, nodes):
+        '''
+        Return the rows of the given nodes as one matrix.
+        '''
+        look_up = self.graph.look_up_dict
+        return self.matrix[[look_up[node] for node in nodes]]
+
+
+def vectors_to_matrix(vectors, dtype=None):
+    '''
+    Stack a dict of node vectors into one matrix, of the vectors' own dtype by default.
+    Returns the node ids and the matrix with one row per node in the same order.
+    '''
+    if isinstance(vectors, EmbeddingView):
+        return vectors.nodes(), np.asarray(vectors.matrix, dtype=dtype)
+    nodes = list(vectors.keys())
+    if not nodes:
+        return nodes, np.zeros((0, 0), dtype=dtype or np.float32)
+    first = np.asarray(vectors[nodes[0]])
+    matrix = np.empty((len(nodes), len(first)), dtype=dtype or first.dtype)
+    for i, node in enumerate(nodes):
+        matrix[i] = vectors[node]
+    return nodes, matrix
+
+
+def save_binary_embeddings(filename, vectors):
+    '''
+    Write the embeddings as a raw float32 matrix in .npy layout to filename
+    and the node id of every row, one per line, to filename + '.ids'.
+    classify.load_binary_embeddings memory-maps the result.
+    '''
+    nodes, matrix = vectors_to_matrix(vectors, np.float32)
+    with open(filename, 'wb') as fout:
+        np.save(fout, matrix)
+    with open(filename + '.ids', 'w') as fout:
+        fout.write(''.join('{}\n'.format(node) for node in nodes))
+
+
+def _format_rows(args):
+    '''
+    Format a block of rows as text lines with a single % operation.
+    '''
+    nodes, matrix, value_fmt = args
+    rows = np.empty((matrix.shape[0], matrix.shape[1]+1), dtype=object)
+    rows[:, 0] = nodes
+    rows[:, 1:] = matrix
+    line_fmt = '%s' + (' ' + value_fmt) * matrix.shape[1] + '\n'
+    return ((line_fmt * matrix.shape[0]) % tuple(rows.ravel())).encode('utf-8')
+
+
+def save_text_embeddings(filename, vectors, precision=None, workers=1,
+                         chunk_size=10000):
+    '''
+    Write the embeddings in the text format: a "node_num dim" header line,
+    then one "node dim1 ... dimd" line per node.
+    The matrix is formatted in blocks of chunk_size rows, by workers processes
+    if workers > 1, and gzip compressed if filename ends with .gz.
+    precision is the number of significant digits, by default enough to
+    read back the exact value.
+    '''
+    nodes, matrix = vectors_to_matrix(vectors)
+    if precision is not None:
+        value_fmt = '%.{}g'.format(precision)
+    elif matrix.dtype == np.float64:
+        value_fmt = '%r'
+    else:
+        value_fmt = '%.9g'
+    blocks = [(nodes[i:i+chunk_size], matrix[i:i+chunk_size], value_fmt)
+              for i in range(0, len(nodes), chunk_size)]
+    if filename.endswith('.gz'):
+        fout = gzip.open(filename, 'wb')
+    else:
+        fout = open(filename, 'wb')
+    fout.write('{} {}\n'.format(matrix.shape[0], matrix.shape[1]).encode('utf-8'))
+    if workers > 1 and len(blocks) > 1:
+        pool = multiprocessing.Pool(processes=min(workers, len(blocks)))
+        for text in pool.imap(_format_rows, blocks):
+            fout.write(text)
+        pool.close()
+        pool.join()
+    else:
+        for block in blocks:
+            fout.write(_format_rows(block))
+    fout.close()
@@ -149,14 +149,17 @@ class GCN(object):
             adj, features, y_train, y_val, y_test, train_mask, val_mask, test_mask
             y_train, y_val, y_test can merge to y
         """
-        g = self.graph.G
-        look_back = self.graph.look_back_list
-        self.features = np.vstack([g.nodes[look_back[i]]['feature']
-                                   for i in range(g.number_of_nodes())])
+        if self.graph.features is not None:
+            self.features = self.graph.features
+        else:
+            g = self.graph.G
+            look_back = self.graph.look_back_list
+            self.features = np.vstack([g.nodes[look_back[i]]['feature']
+                                       for i in range(g.number_of_nodes())])
         self.features = preprocess_features(self.features)
         self.build_label()
         self.build_train_val_test()
-        adj = nx.adjacency_matrix(g)  # the type of graph
+        adj = self.graph.adjacency_matrix()
         self.support = [preprocess_adj(adj)]
 
     def construct_feed_dict(self, labels_mask):
@@ -94,12 +94,12 @@ def sparse_to_tuple(sparse_mx):
 
 
 def preprocess_features(features):
-    """Row-normalize feature matrix and convert to tuple representation"""
+    """Row-normalize feature matrix (dense or scipy.sparse) and convert to tuple representation"""
+    features = sp.csr_matrix(features)
     rowsum = np.array(features.sum(1))
     r_inv = np.power(rowsum, -1).flatten()
     r_inv[np.isinf(r_inv)] = 0.
     r_mat_inv = sp.diags(r_inv)
-    features = sp.coo_matrix(features)
     features = r_mat_inv.dot(features)
     return sparse_to_tuple(features)
 
@@ -2,6 +2,7 @@ from __future__ import print_function
 import numpy as np
 import tensorflow as tf
 import networkx as nx
+from .embeddings import EmbeddingView, save_text_embeddings
 
 
 __author__ = "Wang Binlu"
@@ -12,29 +13,19 @@ class GraphFactorization(object):
     def __init__(self, graph, rep_size=128, epoch=120, learning_rate=0.003, weight_decay=1.):
         self.g = graph
 
-        self.node_size = graph.G.number_of_nodes()
+        self.node_size = graph.node_size
         self.rep_size = rep_size
         self.max_iter = epoch
         self.lr = learning_rate
         self.lamb = weight_decay
         self.sess = tf.Session()
         self.adj_mat = self.getAdj()
-        self.vectors = {}
 
         self.embeddings = self.get_train()
-
-        look_back = self.g.look_back_list
-
-        for i, embedding in enumerate(self.embeddings):
-            self.vectors[look_back[i]] = embedding
+        self.vectors = EmbeddingView(self.g, self.embeddings)
 
     def getAdj(self):
-        node_size = self.g.node_size
-        look_up = self.g.look_up_dict
-        adj = np.zeros((node_size, node_size))
-        for edge in self.g.G.edges():
-            adj[look_up[edge[0]]][look_up[edge[1]]] = self.g.G[edge[0]][edge[1]]['weight']
-        return adj
+        return self.g.adjacency_matrix().toarray().astype(np.float64)
 
     def get_train(self):
 
@@ -65,10 +56,5 @@ class GraphFactorization(object):
                 print("step %i: cost: %g" % (step, self.sess.run(cost, feed_dict={Adj: adj_mat, AdjMask: mat_mask})))
         return self.sess.run(_embeddings)
 
-    def save_embeddings(self, filename):
-        fout = open(filename, 'w')
-        node_num = len(self.vectors)
-        fout.write("{} {}\n".format(node_num, self.rep_size))
-        for node, vec in self.vectors.items():
-            fout.write("{} {}\n".format(node, ' '.join([str(x) for x in vec])))
-        fout.close()
+    def save_embeddings(self, filename, **kwargs):
+        save_text_embeddings(filename, self.vectors, **kwargs)
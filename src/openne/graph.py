@@ -1,6 +1,14 @@
 """Graph utilities."""
 
 # from time import time
+import os
+import bz2
+import glob
+import gzip
+import shutil
+import hashlib
+import functools
+import multiprocessing
 import networkx as nx
 import pickle as pkl
 import numpy as np
@@ -10,12 +18,276 @@ __author__ = "Zhang Zhengyan"
 __email__ = "zhangzhengyan14@mails.tsinghua.edu.cn"
 
 
+_CHUNK_SIZE = 1 << 24
+_CACHE_VERSION = 1
+_CACHE_ARRAYS = ('indptr', 'indices', 'weights', 'look_back')
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[[9, 10, 11, 12, 13, 32]] = True
+
+
+def input_files(filename):
+    """ Expand a glob pattern of input shards into the sorted matching files,
+        a plain filename is returned as is
+    """
+    if not any(c in filename for c in '*?['):
+        return [filename]
+    files = sorted(glob.glob(filename))
+    if not files:
+        raise IOError("no input file matches {}".format(filename))
+    return files
+
+
+def is_compressed(filename):
+    return filename.endswith(('.gz', '.bz2', '.xz', '.zst'))
+
+
+def _open_input(filename):
+    """ Open a plain, gzip, bz2, xz or zstd compressed file for binary reads
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    if filename.endswith('.bz2'):
+        return bz2.BZ2File(filename, 'rb')
+    if filename.endswith('.xz'):
+        import lzma
+        return lzma.open(filename, 'rb')
+    if filename.endswith('.zst'):
+        # optional dependency, only needed for zstd shards
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'))
+    return open(filename, 'rb')
+
+
+def _map_shards(func, files, workers):
+    """ Parse input shards, concurrently in a process pool if workers > 1
+    """
+    if workers > 1 and len(files) > 1:
+        pool = multiprocessing.Pool(processes=min(workers, len(files)))
+        results = pool.map(func, files)
+        pool.close()
+        pool.join()
+        return results
+    return [func(f) for f in files]
+
+
+def _iter_chunks(fin, chunk_size=_CHUNK_SIZE):
+    """ Read a binary file in large blocks, each ending on a line boundary
+    """
+    rest = b''
+    while 1:
+        block = fin.read(chunk_size)
+        if not block:
+            break
+        block = rest + block
+        cut = block.rfind(b'\n') + 1
+        rest = block[cut:]
+        if cut:
+            yield block[:cut]
+    if rest:
+        yield rest
+
+
+def _tokenize(chunk):
+    """ Split a block of text into whitespace separated tokens
+        :return: the tokens as a bytes array and the line number of each token
+    """
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    ws = _WHITESPACE[buf]
+    starts = np.flatnonzero(~ws & np.concatenate(([True], ws[:-1])))
+    line_ids = np.searchsorted(np.flatnonzero(buf == 10), starts)
+    return np.array(chunk.split()), line_ids
+
+
+def _as_int_ids(tokens, int_ids=None):
+    """ Convert node tokens to int64 when they are integers
+        :param int_ids: True to require integer ids, None to detect them
+        :return: the int64 ids, or None if the tokens are kept as strings
+    """
+    if int_ids is False:
+        return None
+    try:
+        ids = tokens.astype(np.int64)
+    except ValueError:
+        if int_ids:
+            raise
+        return None
+    # tokens such as '007' would be merged with '7'
+    if int_ids is None and not np.array_equal(ids.astype(tokens.dtype), tokens):
+        return None
+    return ids
+
+
+def _factorize(tokens):
+    """ Encode node tokens as ids in order of first appearance
+        :return: the ids and the distinct tokens in id order
+    """
+    uniq, first, codes = np.unique(
+        tokens, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='mergesort')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[codes.ravel()], uniq[order]
+
+
+def _read_edge_tokens(filename, weighted=False, chunk_size=_CHUNK_SIZE):
+    ncol = 3 if weighted else 2
+    nodes = []
+    weights = []
+    with _open_input(filename) as fin:
+        for chunk in _iter_chunks(fin, chunk_size):
+            tokens, line_ids = _tokenize(chunk)
+            counts = np.bincount(line_ids)
+            if np.any((counts != 0) & (counts != ncol)):
+                raise ValueError(
+                    "{}: expected {} columns per line".format(filename, ncol))
+            tokens = tokens.reshape(-1, ncol)
+            nodes.append(tokens[:, :2].ravel())
+            if weighted:
+                weights.append(tokens[:, 2].astype(np.float32))
+    nodes = np.concatenate(nodes) if nodes else np.array([], dtype='S1')
+    if weighted and weights:
+        weights = np.concatenate(weights)
+    else:
+        weights = np.ones(len(nodes) // 2, dtype=np.float32)
+    return nodes, weights
+
+
+def _read_adj_tokens(filename, chunk_size=_CHUNK_SIZE):
+    """ :return: the tokens and the positions of the head and the
+        neighbor token of every edge
+    """
+    nodes = []
+    heads = []
+    tails = []
+    offset = 0
+    with _open_input(filename) as fin:
+        for chunk in _iter_chunks(fin, chunk_size):
+            tokens, line_ids = _tokenize(chunk)
+            first = np.concatenate(([True], line_ids[1:] != line_ids[:-1]))
+            pos = np.arange(offset, offset + len(tokens))
+            head = np.maximum.accumulate(np.where(first, pos, 0))
+            nodes.append(tokens)
+            heads.append(head[~first])
+            tails.append(pos[~first])
+            offset += len(tokens)
+    if not nodes:
+        empty = np.array([], dtype=np.int64)
+        return np.array([], dtype='S1'), empty, empty
+    return np.concatenate(nodes), np.concatenate(heads), np.concatenate(tails)
+
+
+def _index_dtype(size):
+    return np.int32 if size < np.iinfo(np.int32).max else np.int64
+
+
+def _edges_to_csr(src, dst, weights, node_size, dedup=False):
+    """ Build CSR arrays from encoded edge arrays, rows sorted by column id
+        :param dedup: keep only the last occurrence of repeated edges
+    """
+    order = np.lexsort((dst, src))
+    if dedup and len(order):
+        s, d = src[order], dst[order]
+        last = np.concatenate(((s[1:] != s[:-1]) | (d[1:] != d[:-1]), [True]))
+        order = order[last]
+        src = src[order]
+    counts = np.bincount(src, minlength=node_size)
+    indptr = np.zeros(node_size + 1, dtype=_index_dtype(len(order)))
+    np.cumsum(counts, out=indptr[1:])
+    indices = dst[order].astype(_index_dtype(node_size))
+    weights = weights[order].astype(np.float32)
+    return indptr, indices, weights
+
+
+def has_edges(indptr, indices, src, dst):
+    """ Test many edges src[i] -> dst[i] at once by a binary search of every
+        dst[i] in the sorted CSR row of src[i], all searches advancing together
+        :return: boolean array
+    """
+    src = np.asarray(src)
+    dst = np.asarray(dst)
+    lo = indptr[src].astype(np.int64)
+    end = indptr[src + 1].astype(np.int64)
+    hi = end.copy()
+    active = np.flatnonzero(lo < hi)
+    while len(active):
+        mid = (lo[active] + hi[active]) // 2
+        right = indices[mid] < dst[active]
+        lo[active[right]] = mid[right] + 1
+        hi[active[~right]] = mid[~right]
+        active = active[lo[active] < hi[active]]
+    found = lo < end
+    found[found] = indices[lo[found]] == dst[found]
+    return found
+
+
+def cache_path(cache_dir, filename, **flags):
+    """ Return the cache directory of an input file or shard pattern, keyed
+        by the path, size and mtime of every file and the flags it is read with
+        :param flags: reader options, e.g. graph_format, weighted, directed
+    """
+    key = [_CACHE_VERSION]
+    for f in input_files(filename):
+        stat = os.stat(f)
+        key.append((os.path.abspath(f), stat.st_size, stat.st_mtime))
+    key += sorted(flags.items())
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    name = os.path.basename(filename)
+    for c in '*?[]':
+        name = name.replace(c, '_')
+    return os.path.join(cache_dir, '{}-{}'.format(name, digest[:16]))
+
+
 class Graph(object):
     def __init__(self):
-        self.G = None
-        self.look_up_dict = {}
+        self._G = None
+        self._look_up_dict = {}
         self.look_back_list = []
         self.node_size = 0
+        # node ids are kept as an int64 look_back_list array
+        self.int_ids = False
+        # sparse node features aligned to look_back_list
+        self.features = None
+        # compact CSR adjacency, rows and columns in look_back_list order
+        self.indptr = None
+        self.indices = None
+        self.weights = None
+
+    @property
+    def G(self):
+        """ The networkx graph, materialized from the CSR arrays on demand
+        """
+        if self._G is None and self.indptr is not None:
+            self._G = self.to_networkx()
+        return self._G
+
+    @G.setter
+    def G(self, g):
+        self._G = g
+        self.indptr = None
+        self.indices = None
+        self.weights = None
+
+    @property
+    def look_up_dict(self):
+        """ Map from node to id, built from look_back_list on first use
+        """
+        if self._look_up_dict is None:
+            look_back = self.look_back_list
+            if isinstance(look_back, np.ndarray):
+                look_back = look_back.tolist()
+            self._look_up_dict = dict(
+                (node, i) for i, node in enumerate(look_back))
+        return self._look_up_dict
+
+    @look_up_dict.setter
+    def look_up_dict(self, look_up):
+        self._look_up_dict = look_up
+
+    def parse_node(self, token):
+        """ Convert a node token read from a file to the node key used in G,
+            look_up_dict and the embedding vectors
+        """
+        return int(token) if self.int_ids else token
 
     def encode_node(self):
         look_up = self.look_up_dict
@@ -26,6 +298,134 @@ class Graph(object):
             self.node_size += 1
             self.G.nodes[node]['status'] = ''
 
+    def build_csr(self, keep_nx=True):
+        """ Build the compact CSR arrays (int32 indptr/indices, float32
+            weights) from the networkx graph
+            :param keep_nx: drop the networkx graph afterwards if False
+        """
+        look_up = self.look_up_dict
+        edges = [(look_up[u], look_up[v], w) for u, v, w in
+                 self._G.edges(data='weight', default=1.0)]
+        src = np.array([e[0] for e in edges], dtype=np.int64)
+        dst = np.array([e[1] for e in edges], dtype=np.int64)
+        weights = np.array([e[2] for e in edges], dtype=np.float32)
+        del edges
+        self.indptr, self.indices, self.weights = _edges_to_csr(
+            src, dst, weights, self.node_size)
+        if not keep_nx:
+            self._G = None
+        return self.indptr, self.indices, self.weights
+
+    def read_csr(self, indptr, indices, weights, look_back):
+        """ Use prebuilt CSR arrays as the graph, networkx is only
+            materialized when G is accessed
+            :param look_back: node ids in row order, a list or an integer
+                array for integer ids
+        """
+        self._G = None
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.look_back_list = look_back
+        self.look_up_dict = None
+        self.int_ids = (isinstance(look_back, np.ndarray) and
+                        look_back.dtype.kind in 'iu')
+        self.node_size = len(look_back)
+
+    def get_csr(self):
+        if self.indptr is None:
+            self.build_csr()
+        return self.indptr, self.indices, self.weights
+
+    def to_networkx(self):
+        look_back = np.empty(self.node_size, dtype=object)
+        look_back[:] = self.look_back_list
+        src, dst, weights = self.edge_arrays()
+        G = nx.DiGraph()
+        G.add_nodes_from(look_back, status='')
+        G.add_weighted_edges_from(
+            zip(look_back[src], look_back[dst], weights.tolist()))
+        return G
+
+    def neighbors(self, node_id):
+        """ Neighbor ids of an encoded node, sorted
+        """
+        return self.indices[self.indptr[node_id]:self.indptr[node_id + 1]]
+
+    def has_edges(self, src, dst):
+        """ Whether the encoded edges src[i] -> dst[i] exist, see has_edges
+        """
+        indptr, indices, _ = self.get_csr()
+        return has_edges(indptr, indices, src, dst)
+
+    def out_degrees(self):
+        indptr = self.get_csr()[0]
+        return np.diff(indptr)
+
+    def number_of_edges(self):
+        return len(self.get_csr()[1])
+
+    def edge_arrays(self):
+        """ Return (src, dst, weight) arrays of all edges in CSR order
+        """
+        indptr, indices, weights = self.get_csr()
+        src = np.repeat(np.arange(self.node_size, dtype=indices.dtype),
+                        np.diff(indptr))
+        return src, indices, weights
+
+    def adjacency_matrix(self, weighted=True):
+        """ Return the adjacency as a scipy.sparse.csr_matrix sharing the
+            CSR arrays
+            :param weighted: use 1.0 for every edge if False
+        """
+        indptr, indices, weights = self.get_csr()
+        if not weighted:
+            weights = np.ones(len(indices), dtype=np.float32)
+        return sp.csr_matrix((weights, indices, indptr),
+                             shape=(self.node_size, self.node_size))
+
+    def fingerprint(self):
+        """ sha1 hex digest of the CSR arrays, identifying the graph by its
+            structure and weights rather than by the file it was read from
+        """
+        digest = hashlib.sha1()
+        for arr in self.get_csr():
+            digest.update(arr.dtype.str.encode('utf-8'))
+            digest.update(np.ascontiguousarray(arr))
+        return digest.hexdigest()
+
+    def save_cache(self, path):
+        """ Write the CSR arrays and look_back_list as .npy files into the
+            directory path
+        """
+        arrays = self.get_csr() + (np.array(self.look_back_list),)
+        tmp = '{}.tmp{}'.format(path, os.getpid())
+        if not os.path.isdir(tmp):
+            os.makedirs(tmp)
+        for name, arr in zip(_CACHE_ARRAYS, arrays):
+            np.save(os.path.join(tmp, name + '.npy'), arr)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # another run wrote the same cache first
+            if not os.path.isdir(path):
+                raise
+            shutil.rmtree(tmp)
+
+    def load_cache(self, path, mmap_mode=None):
+        """ Read a graph written by save_cache
+            :param mmap_mode: e.g. 'r' to open the CSR arrays as np.memmap,
+                so graphs larger than RAM are paged in by the OS and
+                processes opening the same cache share one copy
+        """
+        indptr, indices, weights = [
+            np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+            for name in _CACHE_ARRAYS[:3]]
+        look_back = np.load(os.path.join(path, 'look_back.npy'))
+        if look_back.dtype.kind not in 'iu':
+            look_back = look_back.tolist()
+        self.read_csr(indptr, indices, weights, look_back)
+
     def read_g(self, g):
         self.G = g
         self.encode_node()
@@ -79,6 +479,66 @@ class Graph(object):
         fin.close()
         self.encode_node()
 
+    def load_edgelist(self, filename, weighted=False, directed=False,
+                      int_ids=None, workers=1, chunk_size=_CHUNK_SIZE):
+        """ Bulk-load an edge list straight into the CSR arrays, reading the
+            file in large chunks and tokenizing with numpy
+            repeated edges keep the last weight, as read_edgelist does
+            :param filename: the filename of input file, possibly gzip, bz2,
+                xz or zstd compressed, or a glob pattern of shards
+            :param int_ids: keep node ids as integers if True, as strings if
+                False, detect integer ids if None
+            :param workers: number of processes parsing shards
+        """
+        shards = _map_shards(functools.partial(
+            _read_edge_tokens, weighted=weighted, chunk_size=chunk_size),
+            input_files(filename), workers)
+        nodes = np.concatenate([s[0] for s in shards])
+        weights = np.concatenate([s[1] for s in shards])
+        del shards
+        codes, look_back = self._encode_tokens(nodes, int_ids)
+        src, dst = codes[0::2], codes[1::2]
+        if not directed:
+            src, dst = (np.column_stack((src, dst)).ravel(),
+                        np.column_stack((dst, src)).ravel())
+            weights = np.repeat(weights, 2)
+        self._read_encoded(src, dst, weights, look_back)
+
+    def load_adjlist(self, filename, int_ids=None, workers=1,
+                     chunk_size=_CHUNK_SIZE):
+        """ Bulk-load an unweighted adjacency file straight into the CSR
+            arrays, see read_adjlist for the format
+            :param filename: the filename of input file, see load_edgelist
+                for compressed and sharded input
+            :param int_ids: see load_edgelist
+            :param workers: number of processes parsing shards
+        """
+        shards = _map_shards(functools.partial(
+            _read_adj_tokens, chunk_size=chunk_size),
+            input_files(filename), workers)
+        offsets = np.cumsum([0] + [len(s[0]) for s in shards])
+        nodes = np.concatenate([s[0] for s in shards])
+        heads = np.concatenate([s[1] + off for s, off in zip(shards, offsets)])
+        tails = np.concatenate([s[2] + off for s, off in zip(shards, offsets)])
+        del shards
+        codes, look_back = self._encode_tokens(nodes, int_ids)
+        self._read_encoded(codes[heads], codes[tails], None, look_back)
+
+    def _encode_tokens(self, nodes, int_ids):
+        ids = _as_int_ids(nodes, int_ids)
+        if ids is not None:
+            return _factorize(ids)
+        codes, look_back = _factorize(nodes)
+        return codes, np.char.decode(look_back, 'utf-8').tolist()
+
+    def _read_encoded(self, src, dst, weights, look_back):
+        node_size = len(look_back)
+        if weights is None:
+            weights = np.ones(len(src), dtype=np.float32)
+        indptr, indices, weights = _edges_to_csr(
+            src, dst, weights, node_size, dedup=True)
+        self.read_csr(indptr, indices, weights, look_back)
+
     def read_node_label(self, filename):
         fin = open(filename, 'r')
         while 1:
@@ -86,17 +546,51 @@ class Graph(object):
             if l == '':
                 break
             vec = l.split()
-            self.G.nodes[vec[0]]['label'] = vec[1:]
+            self.G.nodes[self.parse_node(vec[0])]['label'] = vec[1:]
         fin.close()
 
     def read_node_features(self, filename):
         fin = open(filename, 'r')
         for l in fin.readlines():
             vec = l.split()
-            self.G.nodes[vec[0]]['feature'] = np.array(
+            self.G.nodes[self.parse_node(vec[0])]['feature'] = np.array(
                 [float(x) for x in vec[1:]])
         fin.close()
 
+    def read_node_features_sparse(self, filename, chunk_size=_CHUNK_SIZE):
+        """ Stream node features into a scipy.sparse.csr_matrix stored in
+            self.features, one row per node in look_back_list order
+            nodes without a line in the file get an all-zero row
+            :param filename: the filename of input file
+        """
+        look_up = self.look_up_dict
+        rows, cols, data = [], [], []
+        num_features = 0
+        with open(filename, 'rb') as fin:
+            for chunk in _iter_chunks(fin, chunk_size):
+                tokens, line_ids = _tokenize(chunk)
+                first = np.concatenate(([True], line_ids[1:] != line_ids[:-1]))
+                pos = np.arange(len(tokens))
+                head = np.maximum.accumulate(np.where(first, pos, 0))
+                node_rows = np.array(
+                    [look_up[self.parse_node(node.decode('utf-8'))]
+                     for node in tokens[first]], dtype=np.int64)
+                values = tokens[~first].astype(np.float32)
+                col = (pos - head - 1)[~first]
+                row = node_rows[(np.cumsum(first) - 1)[~first]]
+                if len(col):
+                    num_features = max(num_features, col.max() + 1)
+                nz = values != 0
+                rows.append(row[nz])
+                cols.append(col[nz])
+                data.append(values[nz])
+        if not rows:
+            rows = cols = [np.array([], dtype=np.int64)]
+            data = [np.array([], dtype=np.float32)]
+        self.features = sp.csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(self.node_size, num_features))
+
     def read_node_status(self, filename):
         fin = open(filename, 'r')
         while 1:
@@ -104,7 +598,7 @@ class Graph(object):
             if l == '':
                 break
             vec = l.split()
-            self.G.nodes[vec[0]]['status'] = vec[1]  # train test valid
+            self.G.nodes[self.parse_node(vec[0])]['status'] = vec[1]  # train test valid
         fin.close()
 
     def read_edge_label(self, filename):
@@ -114,5 +608,5 @@ class Graph(object):
             if l == '':
                 break
             vec = l.split()
-            self.G[vec[0]][vec[1]]['label'] = vec[2:]
+            self.G[self.parse_node(vec[0])][self.parse_node(vec[1])]['label'] = vec[2:]
         fin.close()
@@ -2,6 +2,7 @@ import math
 import numpy as np
 from numpy import linalg as la
 from sklearn.preprocessing import normalize
+from .embeddings import EmbeddingView, save_text_embeddings
 
 
 class GraRep(object):
@@ -14,13 +15,8 @@ class GraRep(object):
         self.train()
 
     def getAdjMat(self):
-        graph = self.g.G
-        node_size = self.g.node_size
-        look_up = self.g.look_up_dict
-        adj = np.zeros((node_size, node_size))
-        for edge in self.g.G.edges():
-            adj[look_up[edge[0]]][look_up[edge[1]]] = 1.0
-            adj[look_up[edge[1]]][look_up[edge[0]]] = 1.0
+        adj = self.g.adjacency_matrix(weighted=False)
+        adj = ((adj + adj.T) > 0).toarray().astype(np.float64)
         # ScaleSimMat
         return np.matrix(adj/np.sum(adj, axis=1))
 
@@ -38,13 +34,8 @@ class GraRep(object):
         Sd = S[0:self.dim]
         return np.array(Ud)*np.power(Sd, alpha).reshape((self.dim))
 
-    def save_embeddings(self, filename):
-        fout = open(filename, 'w')
-        node_num = len(self.vectors.keys())
-        fout.write("{} {}\n".format(node_num, self.Kstep*self.dim))
-        for node, vec in self.vectors.items():
-            fout.write("{} {}\n".format(node, ' '.join([str(x) for x in vec])))
-        fout.close()
+    def save_embeddings(self, filename, **kwargs):
+        save_text_embeddings(filename, self.vectors, **kwargs)
 
     def train(self):
         self.adj = self.getAdjMat()
@@ -59,7 +50,4 @@ class GraRep(object):
             Rk = normalize(Rk, axis=1, norm='l2')
             self.RepMat[:, self.dim*i:self.dim*(i+1)] = Rk[:, :]
         # get embeddings
-        self.vectors = {}
-        look_back = self.g.look_back_list
-        for i, embedding in enumerate(self.RepMat):
-            self.vectors[look_back[i]] = embedding
+        self.vectors = EmbeddingView(self.g, self.RepMat)
@@ -1,4 +1,3 @@
-import networkx as nx
 import numpy as np
 import scipy.io as sio
 import scipy.sparse as sp
@@ -6,6 +5,7 @@ import scipy.sparse.linalg as lg
 from . import graph as g
 import tensorflow as tf
 from sklearn.preprocessing import normalize
+from .embeddings import EmbeddingView, save_text_embeddings
 
 __author__ = "Alan WANG"
 __email__ = "alan1995wang@outlook.com"
@@ -17,22 +17,20 @@ class HOPE(object):
           d: representation vector dimension
         '''
         self._d = d
-        self._graph = graph.G
         self.g = graph
         self._node_num = graph.node_size
         self.learn_embedding()
 
     def learn_embedding(self):
 
-        graph = self.g.G
-        A = nx.to_numpy_matrix(graph)
+        A = self.g.adjacency_matrix().toarray().astype(np.float64)
 
         # self._beta = 0.0728
 
-        # M_g = np.eye(graph.number_of_nodes()) - self._beta * A
+        # M_g = np.eye(self._node_num) - self._beta * A
         # M_l = self._beta * A
 
-        M_g = np.eye(graph.number_of_nodes())
+        M_g = np.eye(self._node_num)
         M_l = np.dot(A, A)
 
         S = np.dot(np.linalg.inv(M_g), M_l)
@@ -46,17 +44,7 @@ class HOPE(object):
 
     @property
     def vectors(self):
-        vectors = {}
-        look_back = self.g.look_back_list
-        for i, embedding in enumerate(self._X):
-            vectors[look_back[i]] = embedding
-        return vectors
-
-    def save_embeddings(self, filename):
-        fout = open(filename, 'w')
-        node_num = len(self.vectors.keys())
-        fout.write("{} {}\n".format(node_num, self._d))
-        for node, vec in self.vectors.items():
-            fout.write("{} {}\n".format(node,
-                                        ' '.join([str(x) for x in vec])))
-        fout.close()
+        return EmbeddingView(self.g, self._X)
+
+    def save_embeddings(self, filename, **kwargs):
+        save_text_embeddings(filename, self.vectors, **kwargs)
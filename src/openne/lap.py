@@ -1,5 +1,5 @@
 import numpy as np
-import networkx as nx
+from .embeddings import EmbeddingView, save_text_embeddings
 
 
 __author__ = "Wang Binlu"
@@ -9,23 +9,14 @@ __email__ = "wblmail@whu.edu.cn"
 class LaplacianEigenmaps(object):
     def __init__(self, graph, rep_size=128):
         self.g = graph
-        self.node_size = self.g.G.number_of_nodes()
+        self.node_size = self.g.node_size
         self.rep_size = rep_size
-        self.adj_mat = nx.to_numpy_array(self.g.G)
-        self.vectors = {}
+        self.adj_mat = self.getAdj()
         self.embeddings = self.get_train()
-        look_back = self.g.look_back_list
-
-        for i, embedding in enumerate(self.embeddings):
-            self.vectors[look_back[i]] = embedding
+        self.vectors = EmbeddingView(self.g, self.embeddings)
 
     def getAdj(self):
-        node_size = self.g.node_size
-        look_up = self.g.look_up_dict
-        adj = np.zeros((node_size, node_size))
-        for edge in self.g.G.edges():
-            adj[look_up[edge[0]]][look_up[edge[1]]] = self.g.G[edge[0]][edge[1]]['weight']
-        return adj
+        return self.g.adjacency_matrix().toarray().astype(np.float64)
 
     def getLap(self):
         degree_mat = np.diagflat(np.sum(self.adj_mat, axis=1))
@@ -50,11 +41,6 @@ class LaplacianEigenmaps(object):
 
         return vec
 
-    def save_embeddings(self, filename):
-        fout = open(filename, 'w')
-        node_num = len(self.vectors)
-        fout.write("{} {}\n".format(node_num, self.rep_size))
-        for node, vec in self.vectors.items():
-            fout.write("{} {}\n".format(node, ' '.join([str(x) for x in vec])))
-        fout.close()
+    def save_embeddings(self, filename, **kwargs):
+        save_text_embeddings(filename, self.vectors, **kwargs)
 
@@ -1,31 +1,70 @@
 from __future__ import print_function
 import random
-import math
+import threading
 import numpy as np
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 from sklearn.linear_model import LogisticRegression
 import tensorflow as tf
 from .classify import Classifier, read_node_label
+from .embeddings import EmbeddingView, save_text_embeddings
+from .walker import alias_setup_flat, alias_draw_many
+
+
+def prefetch(batches, size):
+    '''
+    Iterate over batches while a background thread produces them, up to size ahead.
+    '''
+    queue = Queue(size)
+    done = object()
+
+    def produce():
+        try:
+            for batch in batches:
+                queue.put(batch)
+        except Exception as e:
+            queue.put(e)
+        queue.put(done)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    while True:
+        batch = queue.get()
+        if batch is done:
+            break
+        if isinstance(batch, Exception):
+            raise batch
+        yield batch
 
 
 class _LINE(object):
 
-    def __init__(self, graph, rep_size=128, batch_size=1000, negative_ratio=5, order=3):
+    def __init__(self, graph, rep_size=128, batch_size=1000, negative_ratio=5, order=3,
+                 prefetch_size=16, session_config=None):
         self.cur_epoch = 0
         self.order = order
         self.g = graph
-        self.node_size = graph.G.number_of_nodes()
+        self.node_size = graph.node_size
         self.rep_size = rep_size
         self.batch_size = batch_size
         self.negative_ratio = negative_ratio
+        self.prefetch_size = prefetch_size
 
         self.gen_sampling_table()
-        self.sess = tf.Session()
-        cur_seed = random.getrandbits(32)
-        initializer = tf.contrib.layers.xavier_initializer(
-            uniform=False, seed=cur_seed)
-        with tf.variable_scope("model", reuse=None, initializer=initializer):
-            self.build_graph()
-        self.sess.run(tf.global_variables_initializer())
+        # every model has its own TensorFlow graph and session, so that models
+        # can train concurrently, see LINE
+        self.tf_graph = tf.Graph()
+        with self.tf_graph.as_default():
+            self.sess = tf.Session(config=session_config)
+            cur_seed = random.getrandbits(32)
+            initializer = tf.contrib.layers.xavier_initializer(
+                uniform=False, seed=cur_seed)
+            with tf.variable_scope("model", reuse=None, initializer=initializer):
+                self.build_graph()
+            self.sess.run(tf.global_variables_initializer())
 
     def build_graph(self):
         self.h = tf.placeholder(tf.int32, [None])
@@ -57,7 +96,7 @@ class _LINE(object):
 
     def train_one_epoch(self):
         sum_loss = 0.0
-        batches = self.batch_iter()
+        batches = prefetch(self.batch_iter(), self.prefetch_size)
         batch_id = 0
         for batch in batches:
             h, t, sign = batch
@@ -73,149 +112,105 @@ class _LINE(object):
         self.cur_epoch += 1
 
     def batch_iter(self):
-        look_up = self.g.look_up_dict
-
-        table_size = 1e8
-        numNodes = self.node_size
-
-        edges = [(look_up[x[0]], look_up[x[1]]) for x in self.g.G.edges()]
-
-        data_size = self.g.G.number_of_edges()
-        edge_set = set([x[0]*numNodes+x[1] for x in edges])
-        shuffle_indices = np.random.permutation(np.arange(data_size))
-
-        # positive or negative mod
-        mod = 0
-        mod_size = 1 + self.negative_ratio
-        h = []
-        t = []
-        sign = 0
-
-        start_index = 0
-        end_index = min(start_index+self.batch_size, data_size)
-        while start_index < data_size:
-            if mod == 0:
-                sign = 1.
-                h = []
-                t = []
-                for i in range(start_index, end_index):
-                    if not random.random() < self.edge_prob[shuffle_indices[i]]:
-                        shuffle_indices[i] = self.edge_alias[shuffle_indices[i]]
-                    cur_h = edges[shuffle_indices[i]][0]
-                    cur_t = edges[shuffle_indices[i]][1]
-                    h.append(cur_h)
-                    t.append(cur_t)
-            else:
-                sign = -1.
-                t = []
-                for i in range(len(h)):
-                    t.append(
-                        self.sampling_table[random.randint(0, table_size-1)])
-
-            yield h, t, [sign]
-            mod += 1
-            mod %= mod_size
-            if mod == 0:
-                start_index = end_index
-                end_index = min(start_index+self.batch_size, data_size)
+        '''
+        Yield a batch of batch_size positive edges, drawn through the edge alias table,
+        followed by negative_ratio batches of the same heads with sampled tails.
+        '''
+        # edges are addressed by their position in the CSR arrays, so a
+        # memory-mapped graph is read in place
+        indptr, indices = self.g.get_csr()[:2]
+
+        data_size = len(indices)
+        shuffle_indices = np.random.permutation(data_size)
+
+        for start_index in range(0, data_size, self.batch_size):
+            batch = shuffle_indices[start_index:start_index+self.batch_size]
+            keep = np.random.random_sample(len(batch)) < self.edge_prob[batch]
+            batch = np.where(keep, batch, self.edge_alias[batch])
+            # the head of an edge is the CSR row holding its position
+            h = np.searchsorted(indptr, batch, side='right') - 1
+            yield h, indices[batch], [1.]
+            for _ in range(self.negative_ratio):
+                yield h, alias_draw_many(self.neg_J, self.neg_q, len(h)), [-1.]
 
     def gen_sampling_table(self):
-        table_size = 1e8
         power = 0.75
-        numNodes = self.node_size
 
         print("Pre-procesing for non-uniform negative sampling!")
-        node_degree = np.zeros(numNodes)  # out degree
-
-        look_up = self.g.look_up_dict
-        for edge in self.g.G.edges():
-            node_degree[look_up[edge[0]]
-                        ] += self.g.G[edge[0]][edge[1]]["weight"]
-
-        norm = sum([math.pow(node_degree[i], power) for i in range(numNodes)])
-
-        self.sampling_table = np.zeros(int(table_size), dtype=np.uint32)
-
-        p = 0
-        i = 0
-        for j in range(numNodes):
-            p += float(math.pow(node_degree[j], power)) / norm
-            while i < table_size and float(i) / table_size < p:
-                self.sampling_table[i] = j
-                i += 1
-
-        data_size = self.g.G.number_of_edges()
-        self.edge_alias = np.zeros(data_size, dtype=np.int32)
-        self.edge_prob = np.zeros(data_size, dtype=np.float32)
-        large_block = np.zeros(data_size, dtype=np.int32)
-        small_block = np.zeros(data_size, dtype=np.int32)
-
-        total_sum = sum([self.g.G[edge[0]][edge[1]]["weight"]
-                         for edge in self.g.G.edges()])
-        norm_prob = [self.g.G[edge[0]][edge[1]]["weight"] *
-                     data_size/total_sum for edge in self.g.G.edges()]
-        num_small_block = 0
-        num_large_block = 0
-        cur_small_block = 0
-        cur_large_block = 0
-        for k in range(data_size-1, -1, -1):
-            if norm_prob[k] < 1:
-                small_block[num_small_block] = k
-                num_small_block += 1
-            else:
-                large_block[num_large_block] = k
-                num_large_block += 1
-        while num_small_block and num_large_block:
-            num_small_block -= 1
-            cur_small_block = small_block[num_small_block]
-            num_large_block -= 1
-            cur_large_block = large_block[num_large_block]
-            self.edge_prob[cur_small_block] = norm_prob[cur_small_block]
-            self.edge_alias[cur_small_block] = cur_large_block
-            norm_prob[cur_large_block] = norm_prob[cur_large_block] + \
-                norm_prob[cur_small_block] - 1
-            if norm_prob[cur_large_block] < 1:
-                small_block[num_small_block] = cur_large_block
-                num_small_block += 1
-            else:
-                large_block[num_large_block] = cur_large_block
-                num_large_block += 1
-
-        while num_large_block:
-            num_large_block -= 1
-            self.edge_prob[large_block[num_large_block]] = 1
-        while num_small_block:
-            num_small_block -= 1
-            self.edge_prob[small_block[num_small_block]] = 1
+        indptr, indices, weights = self.g.get_csr()
+        # out degree, summed from the weights of each CSR row
+        weight_cumsum = np.concatenate(([0.], np.cumsum(weights, dtype=np.float64)))
+        node_degree = weight_cumsum[indptr[1:]] - weight_cumsum[indptr[:-1]]
+
+        # negatives are drawn from degree^0.75 through one alias table over the nodes
+        self.neg_J, self.neg_q = alias_setup_flat(
+            np.power(node_degree, power), [0, self.node_size])
+
+        # positive edges are drawn in proportion to their weights through one alias
+        # table over the CSR positions
+        self.edge_alias, self.edge_prob = alias_setup_flat(weights, [0, len(indices)])
 
     def get_embeddings(self):
-        vectors = {}
         embeddings = self.embeddings.eval(session=self.sess)
         # embeddings = self.sess.run(tf.nn.l2_normalize(self.embeddings.eval(session=self.sess), 1))
-        look_back = self.g.look_back_list
-        for i, embedding in enumerate(embeddings):
-            vectors[look_back[i]] = embedding
-        return vectors
+        return EmbeddingView(self.g, embeddings)
+
+
+def train_concurrently(models):
+    '''
+    Train one epoch of every model at the same time, each in its own thread;
+    TensorFlow releases the GIL while a session runs.
+    '''
+    errors = []
+
+    def train(model):
+        try:
+            model.train_one_epoch()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=train, args=(model,)) for model in models]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
 
 
 class LINE(object):
 
-    def __init__(self, graph, rep_size=128, batch_size=1000, epoch=10, negative_ratio=5, order=3, label_file=None, clf_ratio=0.5, auto_save=True):
+    def __init__(self, graph, rep_size=128, batch_size=1000, epoch=10, negative_ratio=5, order=3, label_file=None, clf_ratio=0.5, auto_save=True,
+                 concurrent=False, workers=None):
+        '''
+        With order 3 and concurrent, the first- and second-order models, which share no
+        parameters, train at the same time in separate sessions, each limited to half
+        of workers threads if given.
+        '''
         self.rep_size = rep_size
         self.order = order
+        self.g = graph
         self.best_result = 0
         self.vectors = {}
         if order == 3:
+            session_config = None
+            if concurrent and workers:
+                threads = max(1, workers // 2)
+                session_config = tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                                inter_op_parallelism_threads=threads)
             self.model1 = _LINE(graph, rep_size/2, batch_size,
-                                negative_ratio, order=1)
+                                negative_ratio, order=1, session_config=session_config)
             self.model2 = _LINE(graph, rep_size/2, batch_size,
-                                negative_ratio, order=2)
+                                negative_ratio, order=2, session_config=session_config)
             for i in range(epoch):
-                self.model1.train_one_epoch()
-                self.model2.train_one_epoch()
+                if concurrent:
+                    train_concurrently([self.model1, self.model2])
+                else:
+                    self.model1.train_one_epoch()
+                    self.model2.train_one_epoch()
                 if label_file:
                     self.get_embeddings()
-                    X, Y = read_node_label(label_file)
+                    X, Y = read_node_label(label_file, graph.int_ids)
                     print("Training classifier using {:.2f}% nodes...".format(
                         clf_ratio*100))
                     clf = Classifier(vectors=self.vectors,
@@ -234,7 +229,7 @@ class LINE(object):
                 self.model.train_one_epoch()
                 if label_file:
                     self.get_embeddings()
-                    X, Y = read_node_label(label_file)
+                    X, Y = read_node_label(label_file, graph.int_ids)
                     print("Training classifier using {:.2f}% nodes...".format(
                         clf_ratio*100))
                     clf = Classifier(vectors=self.vectors,
@@ -252,20 +247,13 @@ class LINE(object):
 
     def get_embeddings(self):
         self.last_vectors = self.vectors
-        self.vectors = {}
         if self.order == 3:
             vectors1 = self.model1.get_embeddings()
             vectors2 = self.model2.get_embeddings()
-            for node in vectors1.keys():
-                self.vectors[node] = np.append(vectors1[node], vectors2[node])
+            self.vectors = EmbeddingView(self.g, np.hstack(
+                (vectors1.matrix, vectors2.matrix)))
         else:
             self.vectors = self.model.get_embeddings()
 
-    def save_embeddings(self, filename):
-        fout = open(filename, 'w')
-        node_num = len(self.vectors.keys())
-        fout.write("{} {}\n".format(node_num, self.rep_size))
-        for node, vec in self.vectors.items():
-            fout.write("{} {}\n".format(node,
-                                        ' '.join([str(x) for x in vec])))
-        fout.close()
+    def save_embeddings(self, filename, **kwargs):
+        save_text_embeddings(filename, self.vectors, **kwargs)
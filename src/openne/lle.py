@@ -1,11 +1,11 @@
 from time import time
-import networkx as nx
 import numpy as np
 import scipy.io as sio
 import scipy.sparse as sp
 import scipy.sparse.linalg as lg
 from . import graph as g
 from sklearn.preprocessing import normalize
+from .embeddings import EmbeddingView, save_text_embeddings
 
 __author__ = "Alan WANG"
 __email__ = "alan1995wang@outlook.com"
@@ -30,13 +30,12 @@ class LLE(object):
         self.learn_embedding()
 
     def learn_embedding(self):
-        graph = self.g.G
-        graph = graph.to_undirected()
         t1 = time()
-        A = nx.to_scipy_sparse_matrix(graph)
+        A = self.g.adjacency_matrix()
+        A = A.maximum(A.T).tocsr()
         # print(np.sum(A.todense(), axis=0))
         normalize(A, norm='l1', axis=1, copy=False)
-        I_n = sp.eye(graph.number_of_nodes())
+        I_n = sp.eye(self._node_num)
         I_min_A = I_n - A
         print(I_min_A)
         u, s, vt = lg.svds(I_min_A, k=self._d + 1, which='SM')
@@ -48,17 +47,7 @@ class LLE(object):
 
     @property
     def vectors(self):
-        vectors = {}
-        look_back = self.g.look_back_list
-        for i, embedding in enumerate(self._X):
-            vectors[look_back[i]] = embedding
-        return vectors
+        return EmbeddingView(self.g, self._X)
 
-    def save_embeddings(self, filename):
-        fout = open(filename, 'w')
-        node_num = len(self.vectors.keys())
-        fout.write("{} {}\n".format(node_num, self._d))
-        for node, vec in self.vectors.items():
-            fout.write("{} {}\n".format(node,
-                                        ' '.join([str(x) for x in vec])))
-        fout.close()
+    def save_embeddings(self, filename, **kwargs):
+        save_text_embeddings(filename, self.vectors, **kwargs)
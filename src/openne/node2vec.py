@@ -1,12 +1,40 @@
 from __future__ import print_function
+import os
 import time
+import tempfile
+import numpy as np
 from gensim.models import Word2Vec
 from . import walker
+from . import skipgram
+from .embeddings import EmbeddingView, save_text_embeddings
 
 
 class Node2vec(object):
 
-    def __init__(self, graph, path_length, num_paths, dim, p=1.0, q=1.0, dw=False, **kwargs):
+    def __init__(self, graph, path_length, num_paths, dim, p=1.0, q=1.0, dw=False,
+                 walk_corpus='memory', corpus_file=None, walk_mode='alias', walk_cache=None,
+                 trainer='gensim', **kwargs):
+        '''
+        walk_corpus selects how the walks reach Word2Vec: 'memory' keeps the int32 walk matrix,
+        'stream' regenerates the walks on every pass of Word2Vec with a walker.WalkCorpus and
+        'file' writes them to corpus_file, a temporary file by default, trained with
+        the corpus_file mode of gensim. Both keep only one walk iteration in memory.
+        'pipeline' trains on the walks while walker processes produce them, through a bounded
+        queue of walk batches, see walker.WalkPipeline; the vocabulary counts are estimated
+        from the graph.
+        walk_mode 'rejection' samples the second-order steps by rejection instead of
+        precomputing an alias table per edge, see walker.Walker.
+        walk_cache is a directory keeping the walk matrix of every graph and walk setting,
+        reused by later runs with the same seed instead of walking again.
+        trainer 'skipgram' trains with the built-in multi-process skipgram.SkipGram on the
+        walk matrices instead of gensim, reading window, negative, iter, alpha, min_alpha,
+        workers and seed from kwargs; it does not read corpus files. It only trains with
+        negative sampling, so deepWalk (dw) drops the hierarchical softmax (hs) it uses in gensim.
+        '''
+        if trainer not in ('gensim', 'skipgram'):
+            raise ValueError("unknown trainer: %s" % trainer)
+        if trainer == 'skipgram' and walk_corpus == 'file':
+            raise ValueError("the skipgram trainer reads walk matrices, not corpus files")
 
         kwargs["workers"] = kwargs.get("workers", 1)
         if dw:
@@ -16,32 +44,96 @@ class Node2vec(object):
 
         self.graph = graph
         if dw:
-            self.walker = walker.BasicWalker(graph, workers=kwargs["workers"])
+            self.walker = walker.BasicWalker(
+                graph, workers=kwargs["workers"], seed=kwargs.get("seed"))
         else:
             self.walker = walker.Walker(
-                graph, p=p, q=q, workers=kwargs["workers"])
-            print("Preprocess transition probs...")
-            self.walker.preprocess_transition_probs()
-        sentences = self.walker.simulate_walks(
-            num_walks=num_paths, walk_length=path_length)
-        kwargs["sentences"] = sentences
+                graph, p=p, q=q, workers=kwargs["workers"], seed=kwargs.get("seed"),
+                mode=walk_mode)
+        walks = None
+        cache_file = None
+        if walk_cache is not None:
+            cache_file = walker.walk_cache_path(
+                walk_cache, graph, self.walker, num_paths, path_length)
+            if cache_file is not None and os.path.exists(cache_file):
+                print("Loading walks from", cache_file)
+                walks = np.load(cache_file, mmap_mode='r')
+        if walks is None:
+            if not dw:
+                print("Preprocess transition probs...")
+                self.walker.preprocess_transition_probs()
+            if cache_file is not None:
+                if not os.path.isdir(walk_cache):
+                    os.makedirs(walk_cache)
+                walks = walker.cache_walks(self.walker, cache_file, num_paths, path_length)
+        # walks reach Word2Vec as node ids, the vocabulary is fixed to the node ids
+        # with counts taken from the walk matrix, not by a gensim scan
+        remove_corpus = False
+        if walk_corpus == 'pipeline' and walks is not None:
+            # the cached walks are ready, nothing left to overlap with training
+            walk_corpus = 'stream'
+        if walk_corpus == 'memory':
+            if walks is None:
+                walks = self.walker.simulate_walks_array(
+                    num_walks=num_paths, walk_length=path_length)
+            corpus = walker.WalkCorpus(self.walker, num_walks=num_paths, walk_length=path_length,
+                                       walks=walks, ids=True)
+            counts = np.bincount(walks[walks >= 0], minlength=graph.node_size)
+        elif walk_corpus == 'stream':
+            corpus = walker.WalkCorpus(self.walker, num_walks=num_paths, walk_length=path_length,
+                                       walks=walks, ids=True)
+            counts = corpus.counts()
+        elif walk_corpus == 'pipeline':
+            corpus = walker.WalkPipeline(self.walker, num_walks=num_paths, walk_length=path_length)
+            counts = corpus.expected_counts()
+        elif walk_corpus == 'file':
+            if corpus_file is None:
+                fd, corpus_file = tempfile.mkstemp(suffix='.walks')
+                os.close(fd)
+                remove_corpus = True
+            counts = walker.WalkCorpus(self.walker, num_walks=num_paths, walk_length=path_length,
+                                       walks=walks, ids=True).save(corpus_file)
+        else:
+            raise ValueError("unknown walk corpus mode: %s" % walk_corpus)
         kwargs["min_count"] = kwargs.get("min_count", 0)
         kwargs["size"] = kwargs.get("size", dim)
         kwargs["sg"] = 1
 
         self.size = kwargs["size"]
         print("Learning representation...")
-        word2vec = Word2Vec(**kwargs)
-        self.vectors = {}
-        for word in graph.G.nodes():
-            self.vectors[word] = word2vec.wv[word]
+        num_sentences = num_paths * graph.node_size
+        if trainer == 'skipgram':
+            if kwargs.get("hs"):
+                print("The skipgram trainer uses negative sampling instead of hierarchical softmax")
+            model = skipgram.SkipGram(
+                counts, dim=self.size, window=kwargs.get("window", 5),
+                negative=kwargs.get("negative", 5), epochs=kwargs.get("iter", 5),
+                alpha=kwargs.get("alpha", 0.025), min_alpha=kwargs.get("min_alpha", 0.0001),
+                workers=kwargs["workers"], seed=kwargs.get("seed"))
+            self.vectors = EmbeddingView(graph, model.train(corpus.blocks, num_sentences))
+            return
+        try:
+            word2vec = Word2Vec(**kwargs)
+            # gensim seeds every vector from its word + str(seed), so the node ids are
+            # string tokens in every corpus mode, as read back from a corpus file
+            word2vec.build_vocab_from_freq(
+                dict(zip(map(str, range(graph.node_size)),
+                         np.ceil(counts).astype(np.int64).tolist())),
+                corpus_count=num_sentences)
+            if walk_corpus == 'file':
+                word2vec.train(corpus_file=corpus_file, total_words=int(counts.sum()),
+                               epochs=word2vec.epochs)
+            else:
+                word2vec.train(corpus, total_examples=num_sentences, epochs=word2vec.epochs)
+        finally:
+            if remove_corpus:
+                os.remove(corpus_file)
+        # gensim orders its vocabulary by frequency, gather the rows back into node id order
+        rows = np.empty(graph.node_size, dtype=np.int64)
+        rows[np.array([int(word) for word in word2vec.wv.index2word], dtype=np.int64)] = \
+            np.arange(len(word2vec.wv.index2word))
+        self.vectors = EmbeddingView(graph, word2vec.wv.vectors[rows])
         del word2vec
 
-    def save_embeddings(self, filename):
-        fout = open(filename, 'w')
-        node_num = len(self.vectors.keys())
-        fout.write("{} {}\n".format(node_num, self.size))
-        for node, vec in self.vectors.items():
-            fout.write("{} {}\n".format(node,
-                                        ' '.join([str(x) for x in vec])))
-        fout.close()
+    def save_embeddings(self, filename, **kwargs):
+        save_text_embeddings(filename, self.vectors, **kwargs)
@@ -1,5 +1,6 @@
 import tensorflow as tf
 import numpy as np
+from .embeddings import EmbeddingView, save_text_embeddings
 
 
 __author__ = "Wang Binlu"
@@ -32,7 +33,7 @@ class SDNE(object):
         """
         self.g = graph
 
-        self.node_size = self.g.G.number_of_nodes()
+        self.node_size = self.g.node_size
         self.dim = encoder_layer_list[-1]
 
         self.encoder_layer_list = [self.node_size]
@@ -52,23 +53,13 @@ class SDNE(object):
             self.lr = tf.train.inverse_time_decay(0.03, self.max_iter, decay_steps=1, decay_rate=0.9999)
 
         self.sess = tf.Session()
-        self.vectors = {}
 
         self.adj_mat = self.getAdj()
         self.embeddings = self.train()
-
-        look_back = self.g.look_back_list
-
-        for i, embedding in enumerate(self.embeddings):
-            self.vectors[look_back[i]] = embedding
+        self.vectors = EmbeddingView(self.g, self.embeddings)
 
     def getAdj(self):
-        node_size = self.g.node_size
-        look_up = self.g.look_up_dict
-        adj = np.zeros((node_size, node_size))
-        for edge in self.g.G.edges():
-            adj[look_up[edge[0]]][look_up[edge[1]]] = self.g.G[edge[0]][edge[1]]['weight']
-        return adj
+        return self.g.adjacency_matrix().toarray().astype(np.float64)
 
     def train(self):
         adj_mat = self.adj_mat
@@ -146,13 +137,8 @@ class SDNE(object):
 
         return self.sess.run(_embeddings, feed_dict={AdjBatch: adj_mat})
 
-    def save_embeddings(self, filename):
-        fout = open(filename, 'w')
-        node_num = len(self.vectors)
-        fout.write("{} {}\n".format(node_num, self.dim))
-        for node, vec in self.vectors.items():
-            fout.write("{} {}\n".format(node, ' '.join([str(x) for x in vec])))
-        fout.close()
+    def save_embeddings(self, filename, **kwargs):
+        save_text_embeddings(filename, self.vectors, **kwargs)
 
 
 class SDNE2(object):
@@ -161,7 +147,7 @@ class SDNE2(object):
 
         self.g = graph
 
-        self.node_size = self.g.G.number_of_nodes()
+        self.node_size = self.g.node_size
         self.rep_size = encoder_layer_list[-1]
 
         self.encoder_layer_list = [self.node_size] + encoder_layer_list
@@ -178,24 +164,14 @@ class SDNE2(object):
             self.lr = tf.train.inverse_time_decay(0.1, self.max_iter, decay_steps=1, decay_rate=0.9999)
 
         self.sess = tf.Session()
-        self.vectors = {}
 
         self.adj_mat = self.getAdj()
         self.deg_vec = np.sum(self.adj_mat, axis=1)
         self.embeddings = self.get_train()
-
-        look_back = self.g.look_back_list
-
-        for i, embedding in enumerate(self.embeddings):
-            self.vectors[look_back[i]] = embedding
+        self.vectors = EmbeddingView(self.g, self.embeddings)
 
     def getAdj(self):
-        node_size = self.g.node_size
-        look_up = self.g.look_up_dict
-        adj = np.zeros((node_size, node_size))
-        for edge in self.g.G.edges():
-            adj[look_up[edge[0]]][look_up[edge[1]]] = self.g.G[edge[0]][edge[1]]['weight']
-        return adj
+        return self.g.adjacency_matrix().toarray().astype(np.float64)
 
     def model(self, node, layer_collector, scope_name):
         fc = node
@@ -297,10 +273,5 @@ class SDNE2(object):
 
         return self.sess.run(emb, feed_dict={NodeA: self.adj_mat[0:1, :], NodeB: self.adj_mat[1:, :]})
 
-    def save_embeddings(self, filename):
-        fout = open(filename, 'w')
-        node_num = len(self.vectors)
-        fout.write("{} {}\n".format(node_num, self.rep_size))
-        for node, vec in self.vectors.items():
-            fout.write("{} {}\n".format(node, ' '.join([str(x) for x in vec])))
-        fout.close()
\ No newline at end of file
+    def save_embeddings(self, filename, **kwargs):
+        save_text_embeddings(filename, self.vectors, **kwargs)
@@ -0,0 +1,159 @@
+from __future__ import print_function
+import time
+import multiprocessing
+import numpy as np
+import scipy.sparse as sp
+from .walker import share_array, attach_array, alias_setup_flat, alias_draw_many
+
+
+_worker_state = None
+
+
+def _init_train_worker(descs, params):
+    global _worker_state
+    _worker_state = [attach_array(desc) for desc in descs] + [params]
+
+
+def _train_task(task):
+    syn0, syn1, neg_J, neg_q, params = _worker_state
+    return train_walks(syn0, syn1, neg_J, neg_q, *task, **params)
+
+
+def _scatter_add(target, rows, cols, values, dense):
+    # target[rows[i]] += values[i] * dense[cols[i]] for all i, repeated rows summed,
+    # as one sparse product instead of np.add.at over materialized outer products
+    uniq, inverse = np.unique(rows, return_inverse=True)
+    update = sp.csr_matrix((values, (inverse.ravel(), cols)), shape=(len(uniq), len(dense)))
+    # the product is computed before target[uniq] is read, so that the rows stay
+    # unlocked only for the add and other workers' updates are not overwritten
+    delta = update.dot(dense)
+    target[uniq] += delta
+
+
+def walk_pairs(walks, window, rng=np.random):
+    '''
+    The (center, context) pairs of skip-gram over the rows of a -1 padded walk matrix.
+    As in word2vec every center position uses a window drawn uniformly from 1..window.
+    '''
+    walks = np.asarray(walks)
+    length = walks.shape[1]
+    reduced = rng.randint(1, window + 1, size=walks.shape)
+    centers = []
+    contexts = []
+    for dist in range(1, min(window, length - 1) + 1):
+        left, right = walks[:, :-dist], walks[:, dist:]
+        valid = (left >= 0) & (right >= 0)
+        forward = valid & (reduced[:, :-dist] >= dist)
+        backward = valid & (reduced[:, dist:] >= dist)
+        centers += [left[forward], right[backward]]
+        contexts += [right[forward], left[backward]]
+    if not centers:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(centers), np.concatenate(contexts)
+
+
+def train_walks(syn0, syn1, neg_J, neg_q, walks, alpha, end_alpha, seed,
+                window=5, negative=5, batch_size=10000):
+    '''
+    One pass of skip-gram with negative sampling over a walk matrix, updating the
+    input vectors syn0 and output vectors syn1 in place, batch_size pairs at a time,
+    with the learning rate decaying linearly from alpha to end_alpha.
+    Processes training on the same shared matrices do not lock (Hogwild).
+    Returns the number of trained pairs.
+    '''
+    rng = np.random.RandomState(seed)
+    centers, contexts = walk_pairs(walks, window, rng)
+    order = rng.permutation(len(centers))
+    centers, contexts = centers[order], contexts[order]
+    labels = np.zeros(negative + 1, dtype=np.float32)
+    labels[0] = 1.0
+    for start in range(0, len(centers), batch_size):
+        lr = alpha - (alpha - end_alpha) * start / max(1, len(centers))
+        center = centers[start:start+batch_size]
+        targets = np.empty((len(center), negative + 1), dtype=np.int64)
+        targets[:, 0] = contexts[start:start+batch_size]
+        targets[:, 1:] = alias_draw_many(neg_J, neg_q, (len(center), negative), rng)
+        hidden = syn0[center]
+        outputs = syn1[targets]
+        scores = np.einsum('bd,bkd->bk', hidden, outputs)
+        grads = (labels - 1.0 / (1.0 + np.exp(-np.clip(scores, -6, 6)))) * lr
+        batch = np.arange(len(center))
+        _scatter_add(syn1, targets.ravel(), np.repeat(batch, negative + 1),
+                     grads.ravel(), hidden)
+        _scatter_add(syn0, center, batch, np.ones(len(center), dtype=np.float32),
+                     np.einsum('bk,bkd->bd', grads, outputs))
+    return len(centers)
+
+
+class SkipGram(object):
+    '''
+    Skip-gram with negative sampling over int32 walk matrices, trained by workers
+    processes updating one pair of embedding matrices in shared memory without locks.
+    Negatives are drawn from the node counts raised to the power 0.75, as in word2vec.
+    '''
+
+    def __init__(self, counts, dim=128, window=5, negative=5, epochs=5, alpha=0.025,
+                 min_alpha=0.0001, workers=1, batch_size=10000, chunk_size=10000, seed=None):
+        if seed is None:
+            seed = np.random.randint(2**31 - 1)
+        self.node_size = len(counts)
+        self.dim = dim
+        self.epochs = epochs
+        self.alpha = alpha
+        self.min_alpha = min_alpha
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.params = {'window': window, 'negative': negative, 'batch_size': batch_size}
+        rng = np.random.RandomState(seed)
+        self.syn0 = ((rng.random_sample((self.node_size, dim)) - 0.5) / dim).astype(np.float32)
+        self.syn1 = np.zeros((self.node_size, dim), dtype=np.float32)
+        self.neg_J, self.neg_q = alias_setup_flat(
+            np.power(np.asarray(counts, dtype=np.float64), 0.75), [0, self.node_size])
+
+    def train(self, blocks, total_walks):
+        '''
+        Train epochs passes over the walk matrices returned by calling blocks,
+        e.g. the blocks method of a walker.WalkCorpus, holding total_walks walks in all.
+        Every matrix is split into at least one task per worker, of at most chunk_size walks.
+        Returns the trained input vectors, a (node_size, dim) float32 matrix.
+        '''
+        arrays = [self.syn0, self.syn1, self.neg_J, self.neg_q]
+        pool = None
+        if self.workers > 1:
+            shared = [share_array(array) for array in arrays]
+            self.syn0, self.syn1 = shared[0][1], shared[1][1]
+            arrays = [view for _, view in shared]
+            pool = multiprocessing.Pool(self.workers, _init_train_worker,
+                                        ([desc for desc, _ in shared], self.params))
+        total = max(1, self.epochs * total_walks)
+        done = 0
+        pairs = 0
+        start_time = time.time()
+        try:
+            for epoch in range(self.epochs):
+                for block_id, walks in enumerate(blocks()):
+                    # at least one task per worker, so every block trains in parallel
+                    task_size = max(1, min(self.chunk_size, -(-len(walks) // self.workers)))
+                    tasks = []
+                    for i in range(0, len(walks), task_size):
+                        chunk = np.asarray(walks[i:i+task_size])
+                        tasks.append((chunk, self._alpha(done, total),
+                                      self._alpha(done + len(chunk), total),
+                                      [self.seed, epoch, block_id, i]))
+                        done += len(chunk)
+                    if pool is None:
+                        pairs += sum(train_walks(*(arrays + list(task)), **self.params)
+                                     for task in tasks)
+                    else:
+                        pairs += sum(pool.map(_train_task, tasks, chunksize=1))
+                print('epoch', epoch + 1, '/', self.epochs, 'pairs', pairs,
+                      'pairs/s', int(pairs / max(time.time() - start_time, 1e-6)))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return np.array(self.syn0)
+
+    def _alpha(self, done, total):
+        return max(self.min_alpha, self.alpha - (self.alpha - self.min_alpha) * done / float(total))
@@ -3,7 +3,10 @@ import math
 import numpy as np
 from numpy import linalg as la
 from sklearn.preprocessing import normalize
+import scipy.sparse as sp
+from scipy.sparse.linalg import svds
 from .gcn.utils import *
+from .embeddings import EmbeddingView, save_text_embeddings
 
 
 class TADW(object):
@@ -15,38 +18,40 @@ class TADW(object):
         self.train()
 
     def getAdj(self):
-        graph = self.g.G
-        node_size = self.g.node_size
-        look_up = self.g.look_up_dict
-        adj = np.zeros((node_size, node_size))
-        for edge in self.g.G.edges():
-            adj[look_up[edge[0]]][look_up[edge[1]]] = 1.0
-            adj[look_up[edge[1]]][look_up[edge[0]]] = 1.0
+        adj = self.g.adjacency_matrix(weighted=False)
+        adj = ((adj + adj.T) > 0).toarray().astype(np.float64)
         # ScaleSimMat
         return adj/np.sum(adj, axis=1)
 
-    def save_embeddings(self, filename):
-        fout = open(filename, 'w')
-        node_num = len(self.vectors.keys())
-        fout.write("{} {}\n".format(node_num, self.dim*2))
-        for node, vec in self.vectors.items():
-            fout.write("{} {}\n".format(node, ' '.join([str(x) for x in vec])))
-        fout.close()
+    def save_embeddings(self, filename, **kwargs):
+        save_text_embeddings(filename, self.vectors, **kwargs)
 
     def getT(self):
-        g = self.g.G
-        look_back = self.g.look_back_list
-        self.features = np.vstack([g.nodes[look_back[i]]['feature']
-                                   for i in range(g.number_of_nodes())])
+        if self.g.features is not None:
+            self.features = self.g.features
+        else:
+            g = self.g.G
+            look_back = self.g.look_back_list
+            self.features = np.vstack([g.nodes[look_back[i]]['feature']
+                                       for i in range(g.number_of_nodes())])
         self.preprocessFeature()
         return self.features.T
 
     def preprocessFeature(self):
         if self.features.shape[1] > 200:
-            U, S, VT = la.svd(self.features)
-            Ud = U[:, 0:200]
-            Sd = S[0:200]
+            if sp.issparse(self.features):
+                # truncated SVD of the sparse matrix, top 200 components
+                U, S, VT = svds(self.features, k=200)
+                order = np.argsort(S)[::-1]
+                Ud = U[:, order]
+                Sd = S[order]
+            else:
+                U, S, VT = la.svd(self.features)
+                Ud = U[:, 0:200]
+                Sd = S[0:200]
             self.features = np.array(Ud)*Sd.reshape(200)
+        elif sp.issparse(self.features):
+            self.features = self.features.toarray()
 
     def train(self):
         self.adj = self.getAdj()
@@ -104,7 +109,4 @@ class TADW(object):
         self.Vecs = np.hstack(
             (normalize(self.W.T), normalize(np.dot(self.T.T, self.H.T))))
         # get embeddings
-        self.vectors = {}
-        look_back = self.g.look_back_list
-        for i, embedding in enumerate(self.Vecs):
-            self.vectors[look_back[i]] = embedding
+        self.vectors = EmbeddingView(self.g, self.Vecs)
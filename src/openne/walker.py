@@ -1,164 +1,888 @@
 from __future__ import print_function
+import os
 import random
+import hashlib
+import functools
 import numpy as np
 import multiprocessing
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+from .graph import has_edges
+
+
+def walk_labels(look_back, walk):
+    '''
+    Map a walk of node ids to node labels, integer labels stay plain ints.
+    '''
+    if isinstance(look_back, np.ndarray):
+        return look_back[walk].tolist()
+    return [look_back[i] for i in walk]
+
+
+def walk_matrix_labels(look_back, walks):
+    '''
+    Map the rows of a -1 padded walk matrix to lists of node labels.
+    '''
+    return [walk_labels(look_back, walk[walk >= 0]) for walk in walks]
+
+
+def uniform_walks(indptr, indices, starts, walk_length, rng=np.random):
+    '''
+    Advance one walk per start node simultaneously over the CSR arrays,
+    stepping to a uniformly chosen neighbor with one random draw per walk and step.
+    Returns an int32 (len(starts), walk_length) matrix, padded with -1 after dead ends.
+    '''
+    walks = np.full((len(starts), walk_length), -1, dtype=np.int32)
+    walks[:, 0] = starts
+    rows = np.arange(len(starts))
+    cur = np.asarray(starts)
+    for step in range(1, walk_length):
+        offset = indptr[cur]
+        degree = indptr[cur+1] - offset
+        alive = degree > 0
+        if not alive.all():
+            rows, cur, offset, degree = rows[alive], cur[alive], offset[alive], degree[alive]
+            if not len(rows):
+                break
+        choice = (rng.random_sample(len(rows)) * degree).astype(np.int64)
+        cur = indices[offset + np.minimum(choice, degree - 1)]
+        walks[rows, step] = cur
+    return walks
+
+
+def weighted_walks(indptr, indices, node_J, node_q, starts, walk_length, rng=np.random):
+    '''
+    Advance one first-order walk per start node simultaneously, stepping to a neighbor
+    drawn in proportion to the edge weight from the flat node alias tables, see alias_setup_flat.
+    Returns an int32 (len(starts), walk_length) matrix, padded with -1 after dead ends.
+    '''
+    walks = np.full((len(starts), walk_length), -1, dtype=np.int32)
+    walks[:, 0] = starts
+    rows = np.arange(len(starts))
+    cur = np.asarray(starts)
+    for step in range(1, walk_length):
+        offset = indptr[cur]
+        degree = indptr[cur+1] - offset
+        alive = degree > 0
+        if not alive.all():
+            rows, cur, offset, degree = rows[alive], cur[alive], offset[alive], degree[alive]
+            if not len(rows):
+                break
+        cur = indices[offset + alias_draw_flat(node_J, node_q, offset, degree, rng)]
+        walks[rows, step] = cur
+    return walks
+
+
+def is_weighted(weights):
+    '''
+    Whether the edge weights differ, otherwise walks can ignore them.
+    '''
+    return len(weights) > 0 and bool((weights != weights[0]).any())
 
 
 def deepwalk_walk_wrapper(class_instance, walk_length, start_node):
     class_instance.deepwalk_walk(walk_length, start_node)
 
 
+def node2vec_walks(indptr, indices, node_J, node_q, edge_J, edge_q, edge_offsets,
+                   starts, walk_length, rng=np.random):
+    '''
+    Advance one second-order walk per start node simultaneously, drawing every step
+    from the flat alias tables built by Walker.preprocess_transition_probs. The table of
+    edge e, which is position e in the CSR arrays, starts at edge_offsets[e] and covers
+    the neighbors of indices[e].
+    Returns an int32 (len(starts), walk_length) matrix, padded with -1 after dead ends.
+    '''
+    walks = np.full((len(starts), walk_length), -1, dtype=np.int32)
+    walks[:, 0] = starts
+    rows = np.arange(len(starts))
+    cur = np.asarray(starts)
+    edge = None
+    for step in range(1, walk_length):
+        offset = indptr[cur]
+        degree = indptr[cur+1] - offset
+        alive = degree > 0
+        if not alive.all():
+            rows, cur, offset, degree = rows[alive], cur[alive], offset[alive], degree[alive]
+            if edge is not None:
+                edge = edge[alive]
+            if not len(rows):
+                break
+        if edge is None:
+            choice = alias_draw_flat(node_J, node_q, offset, degree, rng)
+        else:
+            choice = alias_draw_flat(edge_J, edge_q, edge_offsets[edge], degree, rng)
+        edge = offset + choice
+        cur = indices[edge]
+        walks[rows, step] = cur
+    return walks
+
+
+def node2vec_rejection_walks(indptr, indices, node_J, node_q, starts, walk_length,
+                             rng=np.random, p=1.0, q=1.0):
+    '''
+    Advance one second-order walk per start node simultaneously without edge alias tables:
+    the next node x after the step t -> cur is proposed from the first-order alias table
+    of cur and accepted with probability f(x) / max(1/p, 1, 1/q), where f(x) is 1/p for
+    x == t, 1 if x has an edge to t and 1/q otherwise, proposing again for the rejected
+    walks. The accepted steps follow the same distribution as node2vec_walks.
+    Rows of the CSR arrays must be sorted, see has_edges.
+    Returns an int32 (len(starts), walk_length) matrix, padded with -1 after dead ends.
+    '''
+    bound = max(1.0 / p, 1.0, 1.0 / q)
+    walks = np.full((len(starts), walk_length), -1, dtype=np.int32)
+    walks[:, 0] = starts
+    rows = np.arange(len(starts))
+    cur = np.asarray(starts)
+    prev = None
+    for step in range(1, walk_length):
+        offset = indptr[cur]
+        degree = indptr[cur+1] - offset
+        alive = degree > 0
+        if not alive.all():
+            rows, cur, offset, degree = rows[alive], cur[alive], offset[alive], degree[alive]
+            if prev is not None:
+                prev = prev[alive]
+            if not len(rows):
+                break
+        if prev is None:
+            nxt = indices[offset + alias_draw_flat(node_J, node_q, offset, degree, rng)]
+        else:
+            nxt = np.empty(len(rows), dtype=indices.dtype)
+            pending = np.arange(len(rows))
+            while len(pending):
+                start = offset[pending]
+                cand = indices[start + alias_draw_flat(node_J, node_q, start,
+                                                       degree[pending], rng)]
+                back = prev[pending]
+                bias = np.where(has_edges(indptr, indices, cand, back), 1.0, 1.0 / q)
+                bias[cand == back] = 1.0 / p
+                accept = rng.random_sample(len(pending)) * bound < bias
+                nxt[pending[accept]] = cand[accept]
+                pending = pending[~accept]
+        prev, cur = cur, nxt
+        walks[rows, step] = cur
+    return walks
+
+
+def share_array(array):
+    '''
+    Describe an array so that worker processes can attach to it without a copy:
+    memory mapped files are reopened by name, anything else is copied once into
+    shared memory. Returns the descriptor and a view of the shared data.
+    '''
+    array = np.asarray(array) if not isinstance(array, np.memmap) else array
+    if isinstance(array, np.memmap) and array.filename and array.flags.c_contiguous:
+        desc = ('memmap', array.filename, array.dtype.str, array.shape, array.offset)
+        return desc, attach_array(desc)
+    desc, shared = shared_zeros(array.shape, array.dtype)
+    shared[...] = array
+    return desc, shared
+
+
+def shared_zeros(shape, dtype):
+    '''
+    Allocate a zero array directly in shared memory.
+    Returns its share_array descriptor and the array.
+    '''
+    dtype = np.dtype(dtype)
+    shape = tuple(int(n) for n in np.atleast_1d(shape))
+    raw = multiprocessing.RawArray('b', max(int(np.prod(shape)) * dtype.itemsize, 1))
+    desc = ('shared', raw, dtype.str, shape)
+    return desc, attach_array(desc)
+
+
+def attach_array(desc):
+    '''
+    Open an array described by share_array.
+    '''
+    if desc[0] == 'memmap':
+        _, filename, dtype, shape, offset = desc
+        return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+    _, raw, dtype, shape = desc
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    return np.frombuffer(raw, dtype=dtype, count=count).reshape(shape)
+
+
+class SharedArrays(object):
+    '''
+    The arrays of a walker that worker processes attach to, each put into shared memory
+    once and passed by the same descriptor on every later walk, see share_array.
+    '''
+
+    def __init__(self):
+        self.descs = {}
+
+    def zeros(self, shape, dtype):
+        '''
+        Allocate a zero array in shared memory, for tables built in place.
+        '''
+        desc, array = shared_zeros(shape, dtype)
+        self.descs[id(array)] = (desc, array)
+        return array
+
+    def move(self, array):
+        '''
+        Copy an array into shared memory, the returned array replaces it.
+        '''
+        desc, shared = share_array(array)
+        self.descs[id(shared)] = (desc, shared)
+        return shared
+
+    def describe(self, arrays):
+        '''
+        The descriptors of arrays, sharing those not shared yet.
+        '''
+        for array in arrays:
+            if id(array) not in self.descs:
+                self.descs[id(array)] = (share_array(array)[0], array)
+        return [self.descs[id(array)][0] for array in arrays]
+
+
+_worker_arrays = None
+_worker_walks = None
+
+
+def _init_walk_worker(descs, walks_desc):
+    global _worker_arrays, _worker_walks
+    _worker_arrays = [attach_array(desc) for desc in descs]
+    _worker_walks = attach_array(walks_desc)
+
+
+def _walk_task(task):
+    # the part is written into the shared walk matrix instead of being sent back
+    walk_func, starts, walk_length, seed, batch_size, offset = task
+    _walk_batches(walk_func, _worker_arrays, starts, walk_length, seed, batch_size,
+                  _worker_walks[offset:offset+len(starts)])
+
+
+def _walk_batches(walk_func, arrays, starts, walk_length, seed, batch_size, out):
+    rng = np.random.RandomState(seed)
+    for i in range(0, len(starts), batch_size):
+        out[i:i+batch_size] = walk_func(*(list(arrays) + [starts[i:i+batch_size], walk_length, rng]))
+
+
+def iter_walks(walk_func, arrays, node_size, num_walks, walk_length,
+               workers=1, seed=None, batch_size=100000, descs=None):
+    '''
+    Start num_walks walks from every node with walk_func, which is called as
+    walk_func(*arrays, starts, walk_length, rng) and returns a walk matrix,
+    and yield the walk matrix of every walk iteration in turn.
+    Every walk iteration shuffles the start nodes and splits them into one part per
+    worker, each part walking with its own RandomState seeded by (seed, iteration, part),
+    so the walks only depend on the seed and the number of workers.
+    With workers > 1 the parts run in a process pool sharing the arrays, see share_array,
+    or attaching to descs, their descriptors if they are shared already, and write
+    their walks into one walk matrix in shared memory, copied out for every iteration.
+    '''
+    if seed is None:
+        seed = np.random.randint(2**31 - 1)
+    workers = max(1, workers)
+    pool = None
+    if workers > 1 and num_walks > 0:
+        if descs is None:
+            descs = [share_array(array)[0] for array in arrays]
+        walks_desc, shared_walks = shared_zeros((node_size, walk_length), np.int32)
+        pool = multiprocessing.Pool(workers, _init_walk_worker, (descs, walks_desc))
+    print('Walk iteration:')
+    try:
+        for walk_iter in range(num_walks):
+            print(str(walk_iter+1), '/', str(num_walks))
+            nodes = np.random.RandomState([seed, walk_iter]).permutation(node_size).astype(np.int32)
+            parts = np.array_split(nodes, workers)
+            offsets = np.cumsum([0] + [len(starts) for starts in parts[:-1]])
+            tasks = [(walk_func, starts, walk_length, [seed, walk_iter, part], batch_size, offset)
+                     for part, (starts, offset) in enumerate(zip(parts, offsets))]
+            if pool is None:
+                walks = np.empty((node_size, walk_length), dtype=np.int32)
+                for _, starts, _, part_seed, _, offset in tasks:
+                    _walk_batches(walk_func, arrays, starts, walk_length, part_seed, batch_size,
+                                  walks[offset:offset+len(starts)])
+            else:
+                pool.map(_walk_task, tasks, chunksize=1)
+                walks = shared_walks.copy()
+            yield walks
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def run_walks(walk_func, arrays, node_size, num_walks, walk_length,
+              workers=1, seed=None, batch_size=100000, descs=None):
+    '''
+    Concatenate the walk matrices of all walk iterations of iter_walks.
+    '''
+    walks = list(iter_walks(walk_func, arrays, node_size, num_walks, walk_length,
+                            workers=workers, seed=seed, batch_size=batch_size, descs=descs))
+    if not walks:
+        return np.zeros((0, walk_length), dtype=np.int32)
+    return np.concatenate(walks)
+
+
+_WALK_CACHE_VERSION = 1
+
+
+def walk_cache_path(cache_dir, graph, walker, num_walks, walk_length):
+    '''
+    Return the .npy file in cache_dir for the walks of a BasicWalker or Walker on graph,
+    keyed by the graph fingerprint and every setting the walks depend on,
+    or None if the walker has no fixed seed and its walks cannot be reused.
+    '''
+    if walker.seed is None:
+        return None
+    key = [_WALK_CACHE_VERSION, graph.fingerprint(), walker.sampler, walker.seed,
+           max(1, walker.workers), walker.batch_size, num_walks, walk_length]
+    if walker.sampler in ('alias', 'rejection'):
+        key += [walker.p, walker.q]
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, 'walks-{}.npy'.format(digest))
+
+
+def cache_walks(walker, filename, num_walks, walk_length):
+    '''
+    Write the walk matrix of walker to the .npy file filename one walk iteration
+    at a time and return it memory mapped.
+    '''
+    shape = (num_walks * walker.node_size, walk_length)
+    tmp = '{}.tmp{}'.format(filename, os.getpid())
+    if shape[0] * shape[1]:
+        walks = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.int32, shape=shape)
+        row = 0
+        for block in walker.iter_walks_array(num_walks, walk_length):
+            walks[row:row+len(block)] = block
+            row += len(block)
+        walks.flush()
+        del walks
+    else:
+        with open(tmp, 'wb') as fout:
+            np.save(fout, np.zeros(shape, dtype=np.int32))
+    os.rename(tmp, filename)
+    return np.load(filename, mmap_mode='r')
+
+
+class WalkCorpus(object):
+    '''
+    Restartable iterable over the walks of a BasicWalker or Walker as lists of node labels,
+    as strings since gensim Word2Vec takes string tokens, also for integer labels.
+    The walks are generated again on every pass from the same seed, so every pass
+    sees the same corpus while only one walk iteration is held in memory.
+    A walk matrix, e.g. memory mapped by cache_walks, is iterated instead if given.
+    With ids the walks are lists of the node ids instead of labels, again as strings.
+    '''
+
+    def __init__(self, walker, num_walks, walk_length, walks=None, ids=False):
+        if walker.seed is None:
+            walker.seed = np.random.randint(2**31 - 1)
+        self.walker = walker
+        self.num_walks = num_walks
+        self.walk_length = walk_length
+        self.walks = walks
+        self.ids = ids
+
+    def blocks(self):
+        '''
+        Iterate over the walk matrices of the walk iterations, or row blocks of walks.
+        '''
+        if self.walks is None:
+            return self.walker.iter_walks_array(self.num_walks, self.walk_length)
+        step = max(1, self.walker.node_size)
+        return (self.walks[i:i+step] for i in range(0, len(self.walks), step))
+
+    def __len__(self):
+        return self.num_walks * self.walker.node_size
+
+    def __iter__(self):
+        look_back = None if self.ids else self.walker.look_back_list
+        for walks in self.blocks():
+            for walk in walks:
+                walk = walk[walk >= 0]
+                if look_back is None:
+                    yield walk.astype(str).tolist()
+                else:
+                    yield [str(label) for label in walk_labels(look_back, walk)]
+
+    def counts(self):
+        '''
+        Number of occurrences of every node id in the walks, one pass over them.
+        '''
+        counts = np.zeros(self.walker.node_size, dtype=np.int64)
+        for walks in self.blocks():
+            counts += np.bincount(walks[walks >= 0], minlength=len(counts))
+        return counts
+
+    def save(self, filename):
+        '''
+        Write the walks one per line with space separated node labels or ids,
+        the corpus_file format of gensim.
+        Returns the number of occurrences of every node id, see counts.
+        '''
+        look_back = np.arange(self.walker.node_size) if self.ids else self.walker.look_back_list
+        counts = np.zeros(self.walker.node_size, dtype=np.int64)
+        with open(filename, 'w') as fout:
+            for walks in self.blocks():
+                counts += np.bincount(walks[walks >= 0], minlength=len(counts))
+                fout.writelines(' '.join(map(str, walk)) + '\n'
+                                for walk in walk_matrix_labels(look_back, walks))
+        return counts
+
+
+def _produce_walks(queue, walk_func, descs, node_size, num_walks, walk_length,
+                   seed, part, parts, batch_size):
+    # the walks of one part of every walk iteration, the same as iter_walks with parts workers;
+    # an error is put into the queue for the consumer to raise
+    try:
+        arrays = [attach_array(desc) for desc in descs]
+        for walk_iter in range(num_walks):
+            nodes = np.random.RandomState([seed, walk_iter]).permutation(node_size).astype(np.int32)
+            starts = np.array_split(nodes, parts)[part]
+            rng = np.random.RandomState([seed, walk_iter, part])
+            for i in range(0, len(starts), batch_size):
+                queue.put(walk_func(*(arrays + [starts[i:i+batch_size], walk_length, rng])))
+    except Exception as e:
+        queue.put(e)
+    queue.put(None)
+
+
+class WalkPipeline(object):
+    '''
+    Restartable iterable over the walks of a BasicWalker or Walker as lists of node ids,
+    as strings like the ids of a WalkCorpus, produced while they are consumed: every pass starts one walker process per worker,
+    pushing walk matrices of up to batch_size walks into a queue bounded to queue_size
+    of them. A pass holds the same walks as iter_walks_array, in the order they finish.
+    While the queue is empty the walker processes are checked every poll_interval seconds.
+    '''
+
+    def __init__(self, walker, num_walks, walk_length, queue_size=4, poll_interval=1.0):
+        if walker.seed is None:
+            walker.seed = np.random.randint(2**31 - 1)
+        self.walker = walker
+        self.num_walks = num_walks
+        self.walk_length = walk_length
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.descs = walker.shared.describe(walker.alias_arrays())
+
+    def __len__(self):
+        return self.num_walks * self.walker.node_size
+
+    def __iter__(self):
+        for walks in self.blocks():
+            for walk in walks:
+                yield walk[walk >= 0].astype(str).tolist()
+
+    def blocks(self):
+        '''
+        Iterate over the walk matrices as the walker processes deliver them.
+        Raises the error of a walker process, or RuntimeError if one dies without reporting.
+        '''
+        walker = self.walker
+        parts = max(1, walker.workers)
+        queue = multiprocessing.Queue(self.queue_size)
+        producers = [multiprocessing.Process(
+            target=_produce_walks,
+            args=(queue, walker.walk_function(), self.descs, walker.node_size, self.num_walks,
+                  self.walk_length, walker.seed, part, parts, walker.batch_size))
+            for part in range(parts)]
+        for producer in producers:
+            producer.daemon = True
+            producer.start()
+        finished = 0
+        try:
+            while finished < parts:
+                try:
+                    walks = queue.get(timeout=self.poll_interval)
+                except Empty:
+                    for producer in producers:
+                        if producer.exitcode not in (None, 0):
+                            raise RuntimeError('walker process exited with code %d'
+                                               % producer.exitcode)
+                    continue
+                if walks is None:
+                    finished += 1
+                elif isinstance(walks, Exception):
+                    raise walks
+                else:
+                    yield walks
+        finally:
+            for producer in producers:
+                if producer.is_alive():
+                    producer.terminate()
+                producer.join()
+
+    def expected_counts(self):
+        '''
+        Estimate the occurrences of every node id without walking: each walk starts once
+        at every node and visits the later steps in proportion to the incoming edge weights,
+        the stationary distribution of undirected walks.
+        '''
+        walker = self.walker
+        flow = np.bincount(walker.indices, weights=walker.weights, minlength=walker.node_size)
+        if flow.sum() > 0:
+            flow *= walker.node_size * (self.walk_length - 1) / flow.sum()
+        return self.num_walks * (1 + flow)
+
+
 class BasicWalker:
-    def __init__(self, G, workers):
-        self.G = G.G
+    def __init__(self, G, workers, batch_size=100000, seed=None):
+        '''
+        Walks step to uniformly chosen neighbors, or in proportion to the edge weights
+        through node alias tables if the graph is weighted.
+        '''
+        self.indptr, self.indices, self.weights = G.get_csr()
         self.node_size = G.node_size
-        self.look_up_dict = G.look_up_dict
+        self.look_back_list = G.look_back_list
+        self.workers = workers
+        self.batch_size = batch_size
+        self.seed = seed
+        self.shared = SharedArrays()
+        self.alias_nodes = None
+        if is_weighted(self.weights):
+            self.sampler = 'node'
+            self.alias_nodes = self.keep_tables(alias_setup_flat(self.weights, self.indptr))
+        else:
+            self.sampler = 'uniform'
+
+    def keep_tables(self, tables):
+        '''
+        Keep alias tables in shared memory when walking on several processes.
+        '''
+        if self.workers > 1:
+            return tuple(self.shared.move(table) for table in tables)
+        return tables
+
+    def shared_descs(self):
+        '''
+        The descriptors of alias_arrays for worker processes, None on a single worker.
+        '''
+        if self.workers > 1:
+            return self.shared.describe(self.alias_arrays())
+        return None
+
+    def alias_arrays(self):
+        '''
+        The CSR and alias table arrays in the argument order of the walk function.
+        '''
+        if self.sampler == 'node':
+            return [self.indptr, self.indices] + list(self.alias_nodes)
+        return [self.indptr, self.indices]
+
+    def walk_function(self):
+        '''
+        The walk matrix function of the sampler, see run_walks.
+        '''
+        if self.sampler == 'node':
+            return weighted_walks
+        return uniform_walks
 
     def deepwalk_walk(self, walk_length, start_node):
         '''
-        Simulate a random walk starting from start node.
+        Simulate a random walk starting from start node, given and returned as node ids.
         '''
-        G = self.G
-        look_up_dict = self.look_up_dict
-        node_size = self.node_size
+        indptr = self.indptr
+        indices = self.indices
 
         walk = [start_node]
 
         while len(walk) < walk_length:
             cur = walk[-1]
-            cur_nbrs = list(G.neighbors(cur))
-            if len(cur_nbrs) > 0:
-                walk.append(random.choice(cur_nbrs))
+            start, end = indptr[cur], indptr[cur+1]
+            if end > start:
+                walk.append(int(indices[start+random.randrange(end-start)]))
             else:
                 break
         return walk
 
+    def simulate_walks_array(self, num_walks, walk_length):
+        '''
+        Repeatedly simulate random walks from each node on self.workers processes.
+        Returns an int32 (num_walks*node_size, walk_length) matrix of node ids, see uniform_walks.
+        '''
+        return run_walks(self.walk_function(), self.alias_arrays(), self.node_size,
+                         num_walks, walk_length, workers=self.workers,
+                         seed=self.seed, batch_size=self.batch_size,
+                         descs=self.shared_descs())
+
+    def iter_walks_array(self, num_walks, walk_length):
+        '''
+        Yield the walk matrix of every walk iteration, see simulate_walks_array.
+        '''
+        return iter_walks(self.walk_function(), self.alias_arrays(), self.node_size,
+                          num_walks, walk_length, workers=self.workers,
+                          seed=self.seed, batch_size=self.batch_size,
+                          descs=self.shared_descs())
+
     def simulate_walks(self, num_walks, walk_length):
         '''
         Repeatedly simulate random walks from each node.
         '''
-        G = self.G
-        walks = []
-        nodes = list(G.nodes())
-        print('Walk iteration:')
-        for walk_iter in range(num_walks):
-            # pool = multiprocessing.Pool(processes = 4)
-            print(str(walk_iter+1), '/', str(num_walks))
-            random.shuffle(nodes)
-            for node in nodes:
-                # walks.append(pool.apply_async(deepwalk_walk_wrapper, (self, walk_length, node, )))
-                walks.append(self.deepwalk_walk(
-                    walk_length=walk_length, start_node=node))
-            # pool.close()
-            # pool.join()
-        # print(len(walks))
-        return walks
+        walks = self.simulate_walks_array(num_walks, walk_length)
+        return walk_matrix_labels(self.look_back_list, walks)
 
 
 class Walker:
-    def __init__(self, G, p, q, workers):
-        self.G = G.G
+    def __init__(self, G, p, q, workers, batch_size=100000, seed=None, mode='alias'):
+        '''
+        mode 'alias' precomputes an alias table for every edge, O(sum of squared degrees),
+        'rejection' only the node tables, O(E), and samples the biased steps by
+        rejection, see node2vec_rejection_walks.
+        With p == q == 1 the walks are first-order whatever the mode and the sampler
+        falls back to that of BasicWalker: uniform without weights, node tables with.
+        '''
+        if mode not in ('alias', 'rejection'):
+            raise ValueError("unknown walk mode: %s" % mode)
+        self.g = G
+        self.indptr, self.indices, self.weights = G.get_csr()
         self.p = p
         self.q = q
         self.node_size = G.node_size
-        self.look_up_dict = G.look_up_dict
+        self.look_back_list = G.look_back_list
+        self.workers = workers
+        self.batch_size = batch_size
+        self.seed = seed
+        self.shared = SharedArrays()
+        self.mode = mode
+        self.alias_nodes = None
+        self.alias_edges = None
+        if p == 1 and q == 1:
+            self.sampler = 'node' if is_weighted(self.weights) else 'uniform'
+        else:
+            self.sampler = mode
 
-    def node2vec_walk(self, walk_length, start_node):
+    def keep_tables(self, tables):
         '''
-        Simulate a random walk starting from start node.
+        Keep alias tables in shared memory when walking on several processes.
         '''
-        G = self.G
-        alias_nodes = self.alias_nodes
-        alias_edges = self.alias_edges
-        look_up_dict = self.look_up_dict
-        node_size = self.node_size
+        if self.workers > 1:
+            return tuple(self.shared.move(table) for table in tables)
+        return tables
 
-        walk = [start_node]
+    def shared_descs(self):
+        '''
+        The descriptors of alias_arrays for worker processes, None on a single worker.
+        '''
+        if self.workers > 1:
+            return self.shared.describe(self.alias_arrays())
+        return None
 
-        while len(walk) < walk_length:
-            cur = walk[-1]
-            cur_nbrs = list(G.neighbors(cur))
-            if len(cur_nbrs) > 0:
-                if len(walk) == 1:
-                    walk.append(
-                        cur_nbrs[alias_draw(alias_nodes[cur][0], alias_nodes[cur][1])])
-                else:
-                    prev = walk[-2]
-                    pos = (prev, cur)
-                    next = cur_nbrs[alias_draw(alias_edges[pos][0],
-                                               alias_edges[pos][1])]
-                    walk.append(next)
-            else:
-                break
+    def alias_arrays(self):
+        '''
+        The CSR and alias table arrays in the argument order of the walk function.
+        '''
+        arrays = [self.indptr, self.indices]
+        if self.sampler != 'uniform':
+            arrays += list(self.alias_nodes)
+        if self.sampler == 'alias':
+            arrays += list(self.alias_edges)
+        return arrays
+
+    def walk_function(self):
+        '''
+        The walk matrix function of the sampler, see run_walks.
+        '''
+        if self.sampler == 'uniform':
+            return uniform_walks
+        if self.sampler == 'node':
+            return weighted_walks
+        if self.sampler == 'rejection':
+            return functools.partial(node2vec_rejection_walks, p=self.p, q=self.q)
+        return node2vec_walks
 
-        return walk
+    def node2vec_walk(self, walk_length, start_node):
+        '''
+        Simulate a random walk starting from start node, given and returned as node ids.
+        '''
+        walk = self.walk_function()(*(self.alias_arrays() + [[start_node], walk_length]))[0]
+        return walk[walk >= 0].tolist()
+
+    def simulate_walks_array(self, num_walks, walk_length):
+        '''
+        Repeatedly simulate random walks from each node on self.workers processes.
+        Returns an int32 (num_walks*node_size, walk_length) matrix of node ids, see node2vec_walks.
+        '''
+        return run_walks(self.walk_function(), self.alias_arrays(), self.node_size,
+                         num_walks, walk_length, workers=self.workers,
+                         seed=self.seed, batch_size=self.batch_size,
+                         descs=self.shared_descs())
+
+    def iter_walks_array(self, num_walks, walk_length):
+        '''
+        Yield the walk matrix of every walk iteration, see simulate_walks_array.
+        '''
+        return iter_walks(self.walk_function(), self.alias_arrays(), self.node_size,
+                          num_walks, walk_length, workers=self.workers,
+                          seed=self.seed, batch_size=self.batch_size,
+                          descs=self.shared_descs())
 
     def simulate_walks(self, num_walks, walk_length):
         '''
         Repeatedly simulate random walks from each node.
         '''
-        G = self.G
-        walks = []
-        nodes = list(G.nodes())
-        print('Walk iteration:')
-        for walk_iter in range(num_walks):
-            print(str(walk_iter+1), '/', str(num_walks))
-            random.shuffle(nodes)
-            for node in nodes:
-                walks.append(self.node2vec_walk(
-                    walk_length=walk_length, start_node=node))
-
-        return walks
+        walks = self.simulate_walks_array(num_walks, walk_length)
+        return walk_matrix_labels(self.look_back_list, walks)
 
     def get_alias_edge(self, src, dst):
         '''
         Get the alias edge setup lists for a given edge.
         '''
-        G = self.G
+        indptr = self.indptr
         p = self.p
         q = self.q
 
-        unnormalized_probs = []
-        for dst_nbr in G.neighbors(dst):
-            if dst_nbr == src:
-                unnormalized_probs.append(G[dst][dst_nbr]['weight']/p)
-            elif G.has_edge(dst_nbr, src):
-                unnormalized_probs.append(G[dst][dst_nbr]['weight'])
-            else:
-                unnormalized_probs.append(G[dst][dst_nbr]['weight']/q)
-        norm_const = sum(unnormalized_probs)
-        normalized_probs = [
-            float(u_prob)/norm_const for u_prob in unnormalized_probs]
+        start, end = indptr[dst], indptr[dst+1]
+        dst_nbrs = self.indices[start:end]
+        unnormalized_probs = self.weights[start:end] / q
+        back = has_edges(indptr, self.indices, dst_nbrs, np.full(len(dst_nbrs), src))
+        unnormalized_probs[back] = self.weights[start:end][back]
+        unnormalized_probs[dst_nbrs == src] = self.weights[start:end][dst_nbrs == src] / p
+        norm_const = np.sum(unnormalized_probs, dtype=np.float64)
+        normalized_probs = unnormalized_probs / norm_const
 
         return alias_setup(normalized_probs)
 
-    def preprocess_transition_probs(self):
+    def preprocess_transition_probs(self, chunk_size=1 << 24):
         '''
-        Preprocessing of transition probabilities for guiding the random walks.
+        Preprocessing of transition probabilities for guiding the random walks,
+        only the node tables for rejection and weighted first-order walks, none for uniform ones.
+        The tables of all nodes and all edges are concatenated in CSR order:
+        alias_nodes is (J, q) with the table of node v at indptr[v],
+        alias_edges is (J, q, offsets) with the table of edge e at offsets[e].
+        Edge tables are built chunk_size entries at a time.
         '''
-        G = self.G
-
-        alias_nodes = {}
-        for node in G.nodes():
-            unnormalized_probs = [G[node][nbr]['weight']
-                                  for nbr in G.neighbors(node)]
-            norm_const = sum(unnormalized_probs)
-            normalized_probs = [
-                float(u_prob)/norm_const for u_prob in unnormalized_probs]
-            alias_nodes[node] = alias_setup(normalized_probs)
+        indptr = self.indptr
+        indices = self.indices
+        weights = self.weights
+
+        if self.sampler == 'uniform':
+            return
+        self.alias_nodes = self.keep_tables(alias_setup_flat(weights, indptr))
+        if self.sampler != 'alias':
+            return
+
+        degrees = np.diff(indptr)
+        edge_size = len(indices)
+        # the edge tables, the largest structure, are built in place in shared memory
+        # when walking on several processes
+        zeros = self.shared.zeros if self.workers > 1 else np.zeros
+        edge_offsets = zeros(edge_size + 1, np.int64)
+        np.cumsum(degrees[indices], out=edge_offsets[1:])
+        edge_J = zeros(edge_offsets[-1], np.int32)
+        edge_q = zeros(edge_offsets[-1], np.float32)
+
+        # the edge t -> v, its table covers the steps v -> x
+        srcs = np.repeat(np.arange(self.node_size, dtype=np.int32), degrees)
+        lo = 0
+        while lo < edge_size:
+            hi = np.searchsorted(edge_offsets, edge_offsets[lo] + chunk_size, side='right') - 1
+            hi = min(max(hi, lo + 1), edge_size)
+            dsts = indices[lo:hi]
+            sizes = degrees[dsts]
+            seg_ptr = edge_offsets[lo:hi+1] - edge_offsets[lo]
+            pos = (np.repeat(indptr[dsts] - seg_ptr[:-1], sizes) +
+                   np.arange(seg_ptr[-1], dtype=np.int64))
+            x = indices[pos]
+            t = np.repeat(srcs[lo:hi], sizes)
+            w = weights[pos].astype(np.float64)
+            probs = w / self.q
+            back = has_edges(indptr, indices, x, t)
+            probs[back] = w[back]
+            probs[x == t] = w[x == t] / self.p
+            J, q = alias_setup_flat(probs, seg_ptr)
+            edge_J[edge_offsets[lo]:edge_offsets[hi]] = J
+            edge_q[edge_offsets[lo]:edge_offsets[hi]] = q
+            lo = hi
+
+        self.alias_edges = (edge_J, edge_q, edge_offsets)
 
-        alias_edges = {}
-        triads = {}
-
-        look_up_dict = self.look_up_dict
-        node_size = self.node_size
-        for edge in G.edges():
-            alias_edges[edge] = self.get_alias_edge(edge[0], edge[1])
+        return
 
-        self.alias_nodes = alias_nodes
-        self.alias_edges = alias_edges
 
-        return
+def alias_setup_flat(weights, indptr):
+    '''
+    Compute the alias tables of many discrete distributions at once, without a Python loop.
+    The unnormalized weights of distribution i are weights[indptr[i]:indptr[i+1]].
+    Returns flat J and q arrays, J local to each distribution, the table of distribution i
+    at indptr[i], see alias_draw_flat.
+
+    Within a distribution of K outcomes the scaled probabilities K*p below 1 (smalls) are
+    topped up by those at least 1 (larges) in a single sweep: with D the running deficit
+    of the smalls and E the running excess of the larges, both in index order, a small
+    whose deficit starts at D takes the first large with E > D as alias, and a large,
+    once the smalls starting below its E have drained it to 1 + E - D, aliases the next large.
+    '''
+    weights = np.asarray(weights, dtype=np.float64)
+    indptr = np.asarray(indptr, dtype=np.int64)
+    size = len(weights)
+    counts = np.diff(indptr)
+    seg = np.repeat(np.arange(len(counts)), counts)
+    local = np.arange(size, dtype=np.int64) - indptr[seg]
+    J = local.astype(np.int32)
+    q = np.ones(size, dtype=np.float64)
+    if not size:
+        return J, q.astype(np.float32)
+
+    totals = np.bincount(seg, weights=weights, minlength=len(counts))
+    scaled = weights * counts[seg] / totals[seg]
+    small = scaled < 1.0
+    large = ~small
+
+    def segment_cumsum(values):
+        # inclusive cumulative sums restarting at every segment
+        total = np.concatenate(([0], np.cumsum(values)))
+        return total[1:] - total[indptr[:-1]][seg]
+
+    deficit = np.where(small, 1.0 - scaled, 0.0)
+    excess = np.where(large, scaled - 1.0, 0.0)
+    D = segment_cumsum(deficit)
+    E = segment_cumsum(excess)
+
+    # merge the deficit starts of the smalls with the excess ends of the larges,
+    # larges first on ties, and count for every entry the others before it
+    order = np.lexsort((small, np.where(small, D - deficit, E), seg))
+    larges_before = np.empty(size, dtype=np.int64)
+    larges_before[order] = segment_cumsum(large[order]) - large[order]
+    smalls_before = np.empty(size, dtype=np.int64)
+    smalls_before[order] = segment_cumsum(small[order]) - small[order]
+
+    large_pos = np.flatnonzero(large)
+    large_count = np.bincount(seg[large], minlength=len(counts))
+    large_start = np.concatenate(([0], np.cumsum(large_count)))[:-1]
+    small_pos = np.flatnonzero(small)
+    small_start = np.concatenate(([0], np.cumsum(counts - large_count)))[:-1]
+
+    # smalls
+    sm = small_pos[large_count[seg[small_pos]] > 0]
+    sseg = seg[sm]
+    c = np.minimum(larges_before[sm], large_count[sseg] - 1)
+    J[sm] = local[large_pos[large_start[sseg] + c]]
+    q[sm] = scaled[sm]
+
+    # larges except the last one of each segment, which keeps q = 1
+    rank = np.arange(len(large_pos)) - large_start[seg[large_pos]]
+    lg = large_pos[rank < large_count[seg[large_pos]] - 1]
+    lseg = seg[lg]
+    c = smalls_before[lg]
+    drained = np.zeros(len(lg))
+    has = c > 0
+    drained[has] = D[small_pos[small_start[lseg[has]] + c[has] - 1]]
+    J[lg] = local[large_pos[np.searchsorted(large_pos, lg) + 1]]
+    q[lg] = np.clip(1.0 + E[lg] - drained, 0.0, 1.0)
+
+    return J, q.astype(np.float32)
+
+
+def alias_draw_flat(J, q, offsets, sizes, rng=np.random):
+    '''
+    Draw one sample from each of many alias tables at once, table i being the sizes[i]
+    entries at offsets[i] of the flat J and q arrays. Returns the local indices.
+    '''
+    sizes = np.asarray(sizes)
+    kk = np.minimum((rng.random_sample(len(sizes)) * sizes).astype(np.int64), sizes - 1)
+    pos = offsets + kk
+    return np.where(rng.random_sample(len(sizes)) < q[pos], kk, J[pos])
 
 
 def alias_setup(probs):
@@ -205,3 +929,11 @@ def alias_draw(J, q):
         return kk
     else:
         return J[kk]
+
+
+def alias_draw_many(J, q, size, rng=np.random):
+    '''
+    Draw size samples at once from a single alias table.
+    '''
+    kk = np.minimum((rng.random_sample(size) * len(J)).astype(np.int64), len(J) - 1)
+    return np.where(rng.random_sample(size) < q[kk], kk, J[kk])